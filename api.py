@@ -1,20 +1,67 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
+import hashlib
+import io
+import math
 import os
-import json
+import asyncio
+import orjson
 import logging
-from pathlib import Path
-from main import Gemini, Spotify
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from anyio import to_thread
+from urllib.parse import quote_plus
+from main import CircuitOpenError, Gemini, Spotify
+from cache import GeminiCache
+from context_cache import ContextMatcher
+from prompts import normalize_language, prompt_cache_key
+from batching import BatchScheduler
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up API clients before serving and release them on shutdown.
+    
+    Sizes the threadpools and constructs the clients up front so the first
+    request doesn't pay for it; on shutdown, stops background batching and
+    closes the Spotify client's pooled connections.
+    """
+    # asyncio.to_thread uses the loop's default executor; Starlette uses AnyIO's limiter
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREADPOOL_SIZE, thread_name_prefix="blocking")
+    )
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    
+    try:
+        await asyncio.to_thread(get_gemini)
+    except Exception as e:
+        logger.warning("Failed to initialize Gemini client at startup: %s", e)
+    try:
+        await get_spotify()._ensure_valid_token()
+    except Exception as e:
+        logger.warning("Failed to initialize Spotify client at startup: %s", e)
+    if batch_scheduler:
+        batch_scheduler.start()
+    
+    yield
+    
+    if batch_scheduler:
+        await batch_scheduler.stop()
+    if get_spotify.cache_info().currsize:
+        await get_spotify().aclose()
+
 # Initialize FastAPI app
-app = FastAPI(title="Song Suggestor API", version="1.0.0")
+app = FastAPI(
+    title="Song Suggestor API",
+    version="1.0.0",
+    lifespan=lifespan
+)
 
 # Enable CORS for frontend
 # Get allowed origins from environment variable or use defaults
@@ -33,16 +80,72 @@ app.add_middleware(
     expose_headers=["*"],  # Add this
 )
 
-# Create uploads directory
-UPLOAD_DIR = Path(__file__).parent / "uploads"
-UPLOAD_DIR.mkdir(exist_ok=True)
+GOOGLE_SEARCH_URL = "https://www.google.com/search?q="
+
+# Upload limits (image types Gemini accepts)
+ALLOWED_IMAGE_TYPES = frozenset({"image/png", "image/jpeg", "image/webp", "image/heic", "image/heif"})
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10 MB
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 64 KB
+
+# Threads for blocking work (Gemini calls, image hashing). Bounded so bursts
+# queue up instead of spawning threads that contend for the GIL.
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", 16))
+
+# Optional semantic matching of user context in the near-duplicate cache, so
+# paraphrased contexts for the same photo reuse suggestions. Off by default:
+# it needs sentence-transformers and loads an embedding model per worker.
+SEMANTIC_CONTEXT_CACHE = os.getenv("SEMANTIC_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+
+def create_context_matcher() -> ContextMatcher | None:
+    """Build the semantic context matcher if enabled and available."""
+    if not SEMANTIC_CONTEXT_CACHE:
+        return None
+    try:
+        return ContextMatcher()
+    except ImportError as e:
+        logger.warning("Semantic context cache disabled: %s", e)
+        return None
+
+# Near-duplicate image cache for Gemini suggestions (per process)
+gemini_cache = GeminiCache(context_matcher=create_context_matcher())
+
+# Optional micro-batching of concurrent Gemini calls. Off by default: it adds up
+# to BatchScheduler.MAX_WAIT of latency and batched calls skip search grounding.
+GEMINI_BATCHING = os.getenv("GEMINI_BATCHING", "false").lower() in ("1", "true", "yes")
+
+@lru_cache(maxsize=1)
+def get_gemini() -> Gemini:
+    """Return the process-wide Gemini client."""
+    return Gemini()
+
+@lru_cache(maxsize=1)
+def get_spotify() -> Spotify:
+    """Return the process-wide async Spotify client (fetches a token on first use)."""
+    return Spotify()
+
+batch_scheduler = BatchScheduler(get_gemini) if GEMINI_BATCHING else None
+
+async def read_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read an upload in fixed-size chunks, rejecting it once it exceeds max_bytes.
+    
+    Raises:
+        HTTPException: 413 if the upload is larger than max_bytes
+    """
+    buffer = io.BytesIO()
+    total = 0
+    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image is too large. Maximum size is {max_bytes // (1024 * 1024)} MB."
+            )
+        buffer.write(chunk)
+    return buffer.getvalue()
 
 def create_google_search_url(song_title: str, artist: str) -> str:
     """Create a Google search URL for the given song and artist."""
-    import urllib.parse
-    query = f"{song_title} {artist} song"
-    encoded_query = urllib.parse.quote_plus(query)
-    return f"https://www.google.com/search?q={encoded_query}"
+    return f"{GOOGLE_SEARCH_URL}{quote_plus(f'{song_title} {artist} song')}"
 
 class SingleSongResponse(BaseModel):
     """Response model for a single song."""
@@ -58,10 +161,90 @@ class SongResponse(BaseModel):
     """Response model for multiple song suggestions."""
     songs: list[SingleSongResponse]
 
+# Static payloads for the liveness endpoints, serialized once at import
+_ROOT_RESPONSE = Response(
+    content=orjson.dumps({"message": "Song Suggestor API is running! 🎵"}),
+    media_type="application/json"
+)
+_HEALTH_RESPONSE = Response(
+    content=orjson.dumps({"status": "healthy", "message": "API is running smoothly ✨"}),
+    media_type="application/json"
+)
+
 @app.get("/")
 async def root():
     """Root endpoint."""
-    return {"message": "Song Suggestor API is running! 🎵"}
+    return _ROOT_RESPONSE
+
+def response_cache_key(content: bytes, language: str, genre: str, context: str) -> str:
+    """Exact-match cache key for an upload and its options."""
+    return prompt_cache_key(language, genre, context, True, hashlib.sha256(content).hexdigest())
+
+def validate_image_upload(image: UploadFile) -> None:
+    """Reject unsupported or oversized uploads before reading them.
+    
+    Raises:
+        HTTPException: 400 for unsupported types, 413 for oversized uploads
+    """
+    if image.content_type not in ALLOWED_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Please upload a PNG, JPEG, WebP or HEIC image."
+        )
+    if image.size is not None and image.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image is too large. Maximum size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."
+        )
+
+def is_valid_song(song: dict) -> bool:
+    """Check that a suggested song has both a title and an artist."""
+    return bool(song.get("Song_title")) and bool(song.get("Artist"))
+
+def circuit_open_response(e: CircuitOpenError) -> HTTPException:
+    """503 with Retry-After for requests rejected while Gemini is failing fast."""
+    logger.warning("Rejecting request while Gemini circuit is open: %s", e)
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
+def get_spotify_or_none() -> Spotify | None:
+    """Return the shared Spotify client, or None if it can't be constructed."""
+    try:
+        return get_spotify()
+    except Exception as e:
+        logger.warning("Failed to initialize Spotify client: %s", e)
+        return None
+
+async def build_song_response(spotify_client: Spotify | None, idx: int, track_title: str, artist_name: str) -> dict:
+    """Look up one suggested song on Spotify and build its response entry.
+    
+    Spotify failures are isolated to this song and reported via spotify_error.
+    """
+    spotify_error = False
+    track_info = None
+    
+    if not spotify_client:
+        spotify_error = True
+    else:
+        try:
+            track_info = await spotify_client.search_track(track_title, artist_name)
+            logger.info("Song %s: Found on Spotify - %s by %s", idx + 1, track_title, artist_name)
+        except Exception as e:
+            logger.warning("Spotify search failed for song %s (%s): %s", idx + 1, track_title, e)
+            spotify_error = True
+    
+    return {
+        "song_title": track_title,
+        "artist": artist_name,
+        "spotify_url": track_info.get("spotify_url") if track_info else None,
+        "preview_url": track_info.get("preview_url") if track_info else None,
+        "spotify_id": track_info.get("id") if track_info else None,
+        "google_search_url": create_google_search_url(track_title, artist_name),
+        "spotify_error": spotify_error or track_info is None
+    }
 
 @app.post("/suggest-song", response_model=SongResponse)
 async def suggest_song(
@@ -83,118 +266,197 @@ async def suggest_song(
         SongResponse with 3 songs, each with details and Spotify info
     """
     try:
-        # Validate file type
-        if not image.content_type.startswith("image/"):
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid file type. Please upload an image file."
-            )
+        # Validate file type and size before reading anything
+        validate_image_upload(image)
+        # Canonical language so case/whitespace variants share cache entries and batches
+        language = normalize_language(language)
         
-        # Save uploaded image temporarily
-        file_extension = os.path.splitext(image.filename)[1]
-        temp_file_path = UPLOAD_DIR / f"temp_{os.getpid()}{file_extension}"
-        
-        logger.info(f"Processing image: {image.filename}")
-        logger.info(f"Language: {language}")
+        logger.info("Processing image: %s", image.filename)
+        logger.info("Language: %s", language)
         if context:
-            logger.info(f"Context: {context}")
+            logger.info("Context: %s", context)
         
-        # Write file to disk
-        with open(temp_file_path, "wb") as f:
-            content = await image.read()
-            f.write(content)
+        # Keep the upload in memory and hand the bytes straight to Gemini
+        content = await read_upload(image)
         
-        try:
-            # Initialize Gemini AI client
-            gemini_client = Gemini()
-            
-            # Generate song suggestions (3 songs)
-            song_json = gemini_client.song_title_gen(
-                str(temp_file_path),
-                language=language,
-                context=context
-            )
-            
-            # Parse AI response
-            songs_data = json.loads(song_json)
-            song_list = songs_data.get("songs", [])
-            
-            if not song_list or len(song_list) == 0:
-                raise ValueError("No songs returned from AI")
-            
-            # Initialize Spotify client once for all searches
-            spotify_client = None
-            try:
-                spotify_client = Spotify()
-            except Exception as e:
-                logger.warning(f"Failed to initialize Spotify client: {e}")
+        # Byte-identical re-uploads are answered without decoding the image
+        exact_key = await asyncio.to_thread(response_cache_key, content, language, genre, context)
+        song_json = gemini_cache.get_exact(exact_key)
+        
+        if song_json is None:
+            # Reuse suggestions for a near-duplicate image
+            image_hash = await asyncio.to_thread(GeminiCache.image_hash, content)
+            if image_hash is not None:
+                song_json = await asyncio.to_thread(gemini_cache.get, image_hash, language, genre, context)
             
-            # Process each song with individual error handling
-            processed_songs = []
-            for idx, song_data in enumerate(song_list):
-                track_title = song_data.get("Song_title")
-                artist_name = song_data.get("Artist")
-                
-                if not track_title or not artist_name:
-                    logger.warning(f"Invalid song data for song {idx + 1}, skipping")
-                    continue
-                
-                # Search on Spotify with error handling per song
-                spotify_error = False
-                track_info = None
-                
-                if spotify_client:
-                    try:
-                        track_info = spotify_client.search_track(track_title, artist_name)
-                        logger.info(f"Song {idx + 1}: Found on Spotify - {track_title} by {artist_name}")
-                    except Exception as e:
-                        logger.warning(f"Spotify search failed for song {idx + 1} ({track_title}): {e}")
-                        spotify_error = True
+            if song_json is None:
+                if batch_scheduler:
+                    # Combined with other requests arriving in the same window
+                    song_json = await batch_scheduler.submit(
+                        content,
+                        image.content_type,
+                        language=language,
+                        genre=genre,
+                        context=context
+                    )
                 else:
-                    spotify_error = True
-                
-                # Create Google search URL as fallback
-                google_search_url = create_google_search_url(track_title, artist_name)
+                    # Shared Gemini AI client
+                    gemini_client = get_gemini()
+                    
+                    # Generate song suggestions (3 songs) off the event loop
+                    song_json = await asyncio.to_thread(
+                        gemini_client.song_title_gen_bytes,
+                        content,
+                        image.content_type,
+                        language=language,
+                        context=context
+                    )
                 
-                # Build song response
-                song_response = {
-                    "song_title": track_title,
-                    "artist": artist_name,
-                    "spotify_url": track_info.get("spotify_url") if track_info else None,
-                    "preview_url": track_info.get("preview_url") if track_info else None,
-                    "spotify_id": track_info.get("id") if track_info else None,
-                    "google_search_url": google_search_url,
-                    "spotify_error": spotify_error or track_info is None
-                }
-                
-                processed_songs.append(song_response)
-            
-            if not processed_songs:
-                raise ValueError("No valid songs could be processed")
-            
-            logger.info(f"Successfully processed {len(processed_songs)} songs")
-            return {"songs": processed_songs}
+                if image_hash is not None:
+                    gemini_cache.set(image_hash, language, genre, context, song_json)
             
-        finally:
-            # Clean up temporary file
-            if temp_file_path.exists():
-                temp_file_path.unlink()
-                logger.info("Temporary file cleaned up")
+            gemini_cache.set_exact(exact_key, song_json)
+        
+        # Parse AI response
+        songs_data = orjson.loads(song_json)
+        song_list = songs_data.get("songs", [])
+        
+        if not song_list or len(song_list) == 0:
+            raise ValueError("No songs returned from AI")
+        
+        # Drop entries the model returned without a title or artist
+        valid_songs = []
+        for idx, song_data in enumerate(song_list):
+            if not is_valid_song(song_data):
+                logger.warning("Invalid song data for song %s, skipping", idx + 1)
+                continue
+            valid_songs.append(song_data)
+        
+        # Search all songs on Spotify concurrently; failures are isolated per song
+        spotify_client = get_spotify_or_none()
+        processed_songs = await asyncio.gather(
+            *(
+                build_song_response(spotify_client, idx, s["Song_title"], s["Artist"])
+                for idx, s in enumerate(valid_songs)
+            )
+        )
+        
+        if not processed_songs:
+            raise ValueError("No valid songs could be processed")
+        
+        logger.info("Successfully processed %s songs", len(processed_songs))
+        return {"songs": processed_songs}
     
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        raise circuit_open_response(e)
     except ValueError as e:
-        logger.error(f"Validation error: {e}")
+        logger.error("Validation error: %s", e)
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        logger.error(f"Error processing request: {e}")
+        logger.error("Error processing request: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred while processing your request: {str(e)}"
         )
 
+@app.post("/suggest-song/stream")
+async def suggest_song_stream(
+    image: UploadFile = File(...),
+    language: str = Form("English"),
+    genre: str = Form(None),
+    context: str = Form(None)
+):
+    """
+    Stream 3 song suggestions as NDJSON, one line per song as soon as it's ready.
+    
+    Each line has the same shape as an entry of SongResponse.songs. If
+    generation fails before any song is sent, a single {"error": ...} line
+    is emitted instead. Like /suggest-song, responds 503 with Retry-After
+    while the Gemini circuit breaker is open.
+    
+    Args:
+        image: Uploaded image file
+        language: Preferred song language (default: English)
+        genre: Optional preferred genre/vibe (deprecated, not used)
+        context: Optional context about the image (e.g., "me with my brother")
+    """
+    validate_image_upload(image)
+    language = normalize_language(language)
+    
+    logger.info("Streaming suggestions for image: %s", image.filename)
+    content = await read_upload(image)
+    exact_key = await asyncio.to_thread(response_cache_key, content, language, genre, context)
+    
+    # Look up the caches before committing to a 200, so a miss while Gemini is
+    # failing fast gets the same 503 as /suggest-song
+    cached = gemini_cache.get_exact(exact_key)
+    image_hash = None
+    if cached is None:
+        image_hash = await asyncio.to_thread(GeminiCache.image_hash, content)
+        if image_hash is not None:
+            cached = await asyncio.to_thread(gemini_cache.get, image_hash, language, genre, context)
+    if cached is None:
+        try:
+            get_gemini().check_available()
+        except CircuitOpenError as e:
+            raise circuit_open_response(e)
+        except Exception as e:
+            # Client setup errors are reported as an error line by the stream
+            logger.warning("Could not check Gemini availability: %s", e)
+    
+    async def song_stream():
+        spotify_client = get_spotify_or_none()
+        sent = []
+        
+        try:
+            if cached is not None:
+                songs = [s for s in orjson.loads(cached).get("songs", []) if is_valid_song(s)]
+                for song in await asyncio.gather(
+                    *(
+                        build_song_response(spotify_client, idx, s["Song_title"], s["Artist"])
+                        for idx, s in enumerate(songs)
+                    )
+                ):
+                    yield orjson.dumps(song) + b"\n"
+                return
+            
+            # Start each Spotify lookup as soon as Gemini names the song, and
+            # emit results in order without waiting for the whole response
+            pending: list[asyncio.Task] = []
+            async for song in get_gemini().song_title_stream(
+                content, image.content_type, language=language, genre=genre, context=context
+            ):
+                if not is_valid_song(song):
+                    logger.warning("Invalid streamed song data, skipping: %s", song)
+                    continue
+                sent.append(song)
+                pending.append(asyncio.create_task(
+                    build_song_response(spotify_client, len(pending), song["Song_title"], song["Artist"])
+                ))
+                while pending and pending[0].done():
+                    yield orjson.dumps(pending.pop(0).result()) + b"\n"
+            for task in pending:
+                yield orjson.dumps(await task) + b"\n"
+        except Exception as e:
+            logger.error("Error streaming suggestions: %s", e)
+            if not sent:
+                yield orjson.dumps({"error": f"An error occurred while processing your request: {str(e)}"}) + b"\n"
+            return
+        
+        if len(sent) >= 3:
+            song_json = orjson.dumps({"songs": sent}).decode()
+            gemini_cache.set_exact(exact_key, song_json)
+            if image_hash is not None:
+                gemini_cache.set(image_hash, language, genre, context, song_json)
+    
+    return StreamingResponse(song_stream(), media_type="application/x-ndjson")
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "message": "API is running smoothly ✨"}
+    return _HEALTH_RESPONSE
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from main import Gemini
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _BatchItem:
+    """A queued /suggest-song request waiting to be batched."""
+    image_bytes: bytes
+    mime_type: str
+    language: str
+    genre: Optional[str]
+    context: Optional[str]
+    future: asyncio.Future = field(repr=False)
+
+
+class BatchScheduler:
+    """In-process micro-batcher for Gemini song suggestions.
+
+    Requests that arrive within a short window are sent to Gemini as one
+    multi-image call. Requests are only combined when they share a language
+    and genre, because those are part of the shared prompt. Images the
+    batched call returns nothing for are retried one at a time.
+    """
+
+    # Constants
+    MAX_BATCH_SIZE = 4
+    MAX_WAIT = 0.2  # Seconds to wait for more requests after the first arrives
+
+    def __init__(self,
+                 gemini_factory: Callable[[], Gemini],
+                 max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait: float = MAX_WAIT) -> None:
+        """Initialize the scheduler (call start() from a running event loop).
+
+        Args:
+            gemini_factory: Returns the Gemini client to use for each batch
+            max_batch_size: Maximum number of images per Gemini call
+            max_wait: Seconds to hold the first request while collecting a batch
+        """
+        self.gemini_factory = gemini_factory
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        """Start the background task that drains the queue."""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            logger.info("Gemini batching enabled (max %s images / %ss)", self.max_batch_size, self.max_wait)
+
+    async def stop(self) -> None:
+        """Stop collecting new batches and cancel in-flight ones."""
+        tasks = [t for t in (self._worker, *self._tasks) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+
+    async def submit(self, image_bytes: bytes, mime_type: str, language: str = "English",
+                     genre: Optional[str] = None, context: Optional[str] = None) -> str:
+        """Queue an image for batched generation and wait for its suggestions.
+
+        Returns:
+            JSON string containing 3 song suggestions
+
+        Raises:
+            Exception: If generation fails for this image
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_BatchItem(image_bytes, mime_type, language, genre, context, future))
+        return await future
+
+    async def _run(self) -> None:
+        """Collect up to max_batch_size items or max_wait seconds, then dispatch."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            groups = defaultdict(list)
+            for item in batch:
+                groups[(item.language, item.genre)].append(item)
+
+            for items in groups.values():
+                task = asyncio.create_task(self._process(items))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _generate_single(self, gemini_client: Gemini, item: _BatchItem) -> None:
+        """Run the regular one-image pipeline for an item and resolve its future."""
+        try:
+            result = await asyncio.to_thread(
+                gemini_client.song_title_gen_bytes,
+                item.image_bytes,
+                item.mime_type,
+                language=item.language,
+                genre=item.genre,
+                context=item.context
+            )
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+            return
+        if not item.future.done():
+            item.future.set_result(result)
+
+    async def _process(self, items: list[_BatchItem]) -> None:
+        """Generate suggestions for one batch and resolve each item's future."""
+        # Callers that disconnected while waiting have cancelled futures
+        items = [item for item in items if not item.future.done()]
+        if not items:
+            return
+
+        try:
+            gemini_client = self.gemini_factory()
+        except Exception as e:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+
+        if len(items) == 1:
+            await self._generate_single(gemini_client, items[0])
+            return
+
+        try:
+            results = await asyncio.to_thread(
+                gemini_client.song_title_gen_batch,
+                [(item.image_bytes, item.mime_type) for item in items],
+                language=items[0].language,
+                genre=items[0].genre,
+                contexts=[item.context for item in items]
+            )
+        except Exception as e:
+            logger.warning("Batched generation failed, retrying images individually: %s", e)
+            results = [None] * len(items)
+
+        retries = []
+        for item, result in zip(items, results):
+            if result is None:
+                retries.append(self._generate_single(gemini_client, item))
+            elif not item.future.done():
+                item.future.set_result(result)
+        if retries:
+            await asyncio.gather(*retries)
@@ -0,0 +1,136 @@
+import io
+import logging
+from threading import Lock
+from typing import Optional, TYPE_CHECKING
+
+import imagehash
+from cachetools import TTLCache
+from PIL import Image
+
+if TYPE_CHECKING:
+    from context_cache import ContextMatcher
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class GeminiCache:
+    """Near-duplicate image cache for Gemini song suggestions.
+
+    Entries are keyed by the perceptual hash (pHash) of the image plus the
+    request options, so re-uploads of the same or a visually near-identical
+    photo reuse the earlier suggestions instead of calling Gemini again.
+    Byte-identical uploads are also indexed by an exact key, which is checked
+    first and doesn't require decoding the image.
+    """
+
+    # Constants
+    MAX_SIZE = 1024
+    TTL = 24 * 60 * 60  # 24 hours in seconds
+    MAX_DISTANCE = 4  # Max Hamming distance between pHashes to count as a hit
+
+    def __init__(self,
+                 maxsize: int = MAX_SIZE,
+                 ttl: int = TTL,
+                 max_distance: int = MAX_DISTANCE,
+                 context_matcher: Optional["ContextMatcher"] = None) -> None:
+        """Initialize an empty cache.
+
+        Args:
+            maxsize: Maximum number of cached suggestions
+            ttl: Seconds before a cached suggestion expires
+            max_distance: Max pHash Hamming distance treated as the same image
+            context_matcher: Optional semantic matcher for near-duplicate lookups;
+                contexts must match exactly without one
+        """
+        self.max_distance = max_distance
+        self.context_matcher = context_matcher
+        self._entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Exact-match entries keyed by prompt_cache_key; hits skip decoding the image
+        self._exact: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = Lock()
+
+    @staticmethod
+    def image_hash(image_bytes: bytes) -> Optional[int]:
+        """Compute the 64-bit perceptual hash of an image.
+
+        Args:
+            image_bytes: Raw image data
+
+        Returns:
+            pHash as an int, or None if the image cannot be decoded
+        """
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                return int(str(imagehash.phash(img)), 16)
+        except Exception as e:
+            logger.warning("Could not compute image hash: %s", e)
+            return None
+
+    def get_exact(self, key: str) -> Optional[str]:
+        """Look up suggestions for byte-identical image data and options.
+
+        Args:
+            key: Key from prompts.prompt_cache_key
+
+        Returns:
+            Cached JSON string, or None on a miss
+        """
+        with self._lock:
+            song_json = self._exact.get(key)
+        if song_json is not None:
+            logger.info("Gemini cache hit for identical image")
+        return song_json
+
+    def get(self, image_hash: int, language: str, genre: Optional[str], context: Optional[str]) -> Optional[str]:
+        """Look up suggestions for a near-duplicate image with the same options.
+
+        With a context matcher, paraphrased contexts also count as the same.
+        This may run an embedding model, so call it off the event loop.
+
+        Args:
+            image_hash: pHash of the uploaded image
+            language: Requested song language
+            genre: Requested genre (may be None)
+            context: User-provided context (may be None)
+
+        Returns:
+            Cached JSON string, or None on a miss
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+
+        for (cached_hash, cached_language, cached_genre, cached_context), song_json in entries:
+            if (cached_language, cached_genre) != (language, genre):
+                continue
+            if (image_hash ^ cached_hash).bit_count() > self.max_distance:
+                continue
+            if cached_context == context or (
+                self.context_matcher and self.context_matcher.same(cached_context, context)
+            ):
+                logger.info("Gemini cache hit for near-duplicate image")
+                return song_json
+        return None
+
+    def set(self, image_hash: int, language: str, genre: Optional[str], context: Optional[str], song_json: str) -> None:
+        """Store suggestions for an image and its request options.
+
+        Args:
+            image_hash: pHash of the uploaded image
+            language: Requested song language
+            genre: Requested genre (may be None)
+            context: User-provided context (may be None)
+            song_json: JSON string returned by Gemini
+        """
+        with self._lock:
+            self._entries[(image_hash, language, genre, context)] = song_json
+
+    def set_exact(self, key: str, song_json: str) -> None:
+        """Store suggestions for byte-identical image data and options.
+
+        Args:
+            key: Key from prompts.prompt_cache_key
+            song_json: JSON string returned by Gemini
+        """
+        with self._lock:
+            self._exact[key] = song_json
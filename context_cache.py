@@ -0,0 +1,84 @@
+import importlib.util
+import logging
+from threading import Lock
+from typing import Optional
+
+from cachetools import LRUCache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class ContextMatcher:
+    """Semantic equality check for free-form user context strings.
+
+    "golden hour beach with friends" and "friends at the beach at sunset"
+    describe the same photo, so GeminiCache can serve one's suggestions for
+    the other. Contexts are embedded with a small sentence-transformers model
+    and compared by cosine similarity.
+    """
+
+    # Constants
+    MODEL_NAME = "all-MiniLM-L6-v2"
+    THRESHOLD = 0.92  # Min cosine similarity to treat two contexts as the same
+    EMBEDDING_CACHE_SIZE = 4096
+
+    def __init__(self, model_name: str = MODEL_NAME, threshold: float = THRESHOLD) -> None:
+        """Initialize the matcher (the model is loaded on first use).
+
+        Args:
+            model_name: sentence-transformers model to embed contexts with
+            threshold: Min cosine similarity to treat two contexts as the same
+
+        Raises:
+            ImportError: If sentence-transformers is not installed
+        """
+        # Only check it's installed; importing it pulls in torch, so defer that to _get_model
+        if importlib.util.find_spec("sentence_transformers") is None:
+            raise ImportError("sentence-transformers is required for semantic context matching. "
+                              "Install it with: pip install sentence-transformers")
+        self.model_name = model_name
+        self.threshold = threshold
+        self._model = None
+        self._model_lock = Lock()
+        self._embeddings: LRUCache = LRUCache(maxsize=self.EMBEDDING_CACHE_SIZE)
+        self._embeddings_lock = Lock()
+
+    def _get_model(self):
+        """Import sentence-transformers and load the embedding model once, after any worker fork."""
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+                logger.info("Loaded context embedding model: %s", self.model_name)
+            return self._model
+
+    def _embed(self, text: str):
+        """Return the normalized embedding of a context, memoized per string."""
+        with self._embeddings_lock:
+            embedding = self._embeddings.get(text)
+        if embedding is None:
+            embedding = self._get_model().encode(text, normalize_embeddings=True)
+            with self._embeddings_lock:
+                self._embeddings[text] = embedding
+        return embedding
+
+    def same(self, a: Optional[str], b: Optional[str]) -> bool:
+        """Check whether two contexts should share cached suggestions.
+
+        Args:
+            a: First context (may be None)
+            b: Second context (may be None)
+
+        Returns:
+            True if both are empty, identical, or semantically similar
+        """
+        if a == b:
+            return True
+        if not a or not b:
+            return False
+        try:
+            return float(self._embed(a) @ self._embed(b)) >= self.threshold
+        except Exception as e:
+            logger.warning("Could not compare contexts semantically: %s", e)
+            return False
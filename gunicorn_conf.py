@@ -0,0 +1,21 @@
+import os
+
+# Gunicorn configuration for production (see Procfile)
+
+# Bind to the platform-provided port (Railway sets PORT)
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# Multiple worker processes sidestep the GIL for JSON parsing and image hashing
+workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Import the app once in the master and fork workers from it. API clients are
+# created lazily in each worker's lifespan startup, so no sockets are shared.
+preload_app = True
+
+# Gemini calls with grounding can take several seconds
+timeout = 120
+graceful_timeout = 30
+
+loglevel = os.getenv("LOG_LEVEL", "info")
+accesslog = "-"
@@ -1,17 +1,35 @@
-import requests
+import asyncio
+import httpx
 from google import genai
-from google.genai import types
-from pydantic import BaseModel
+from google.genai import types, errors as genai_errors
+from pydantic import BaseModel, Field, ValidationError
 from dotenv import load_dotenv
 import os
 import base64
+import io
+import hashlib
 import time
+import random
 import webbrowser
 import json
+import orjson
+import re
 import mimetypes
-from typing import Optional, Dict, Any
+import tempfile
+from collections import deque
+from threading import Lock
+from types import MappingProxyType
+from typing import Optional, Dict, Any, AsyncIterator, Callable, TypeVar
 import logging
-from prompts import main_prompt
+from cachetools import TTLCache
+from prompts import (
+    prompt_prefix,
+    prompt_suffix,
+    prompt_cache_key,
+    batched_main_prompt,
+    GROUNDED_SYSTEM_INSTRUCTION,
+    FALLBACK_SYSTEM_INSTRUCTION,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,6 +37,106 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Per-user directory for caches that should survive between runs
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "song-suggestor")
+
+
+def _backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter: uniform in [0, min(cap, base * 2**attempt))."""
+    return random.random() * min(cap, base * 2 ** attempt)
+
+
+def _retry_after(headers: Any) -> Optional[float]:
+    """Parse a Retry-After header given in seconds, if present (negative values read as 0)."""
+    value = headers.get("Retry-After") if headers is not None else None
+    try:
+        delay = float(value) if value is not None else None
+    except ValueError:
+        return None
+    if delay is None or delay != delay:  # Missing or NaN
+        return None
+    return max(0.0, delay)
+
+
+def _retry(fn: Callable[..., T], *args, max_retries: int = 3, base: float = 1.0, cap: float = 30.0, **kwargs) -> T:
+    """Call fn, retrying transient Gemini failures with full-jitter exponential backoff.
+    
+    Retries network errors and API errors with a 429/5xx status, honoring
+    Retry-After when the server sends it. A Retry-After longer than cap is
+    not worth blocking on, so the error is raised instead. Anything else
+    (4xx such as an invalid key, ValueError, ...) is raised immediately.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except (httpx.TransportError, genai_errors.APIError) as e:
+            if isinstance(e, genai_errors.APIError) and e.code not in RETRYABLE_STATUSES:
+                raise
+            if attempt == max_retries:
+                raise
+            response = getattr(e, "response", None)
+            delay = _retry_after(getattr(response, "headers", None))
+            if delay is None:
+                delay = _backoff_delay(attempt, base, cap)
+            elif delay > cap:
+                logger.warning("Gemini asked to retry after %.0fs (cap %.0fs), giving up: %s", delay, cap, e)
+                raise
+            logger.info("Transient Gemini error (%s), retrying in %.1fs", e, delay)
+            time.sleep(delay)
+    raise AssertionError("unreachable")
+
+# Load the system MIME database once at import, not on the request path
+mimetypes.init()
+
+# Fallback MIME types for common image extensions the system database may not know
+_EXT_MIME = MappingProxyType({
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp',
+})
+
+# Outermost {...} block in model output that may wrap JSON in prose or code fences
+_JSON_BLOCK_RE = re.compile(r"\{[\s\S]*\}")
+
+# Matches one complete {"Song_title": ..., "Artist": ...} object in (partial) model output
+_SONG_OBJECT_RE = re.compile(
+    r'\{\s*"Song_title"\s*:\s*"((?:[^"\\]|\\.)*)"\s*,\s*"Artist"\s*:\s*"((?:[^"\\]|\\.)*)"\s*\}'
+)
+
+class CircuitOpenError(Exception):
+    """Raised when Gemini calls are short-circuited after repeated failures."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Gemini is temporarily unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class InvalidModelOutputError(ValueError):
+    """Raised when Gemini answers with empty or unusable output."""
+
+
+def _is_provider_failure(error: Optional[BaseException]) -> bool:
+    """Check whether a failed generation was Gemini's fault rather than the caller's.
+    
+    Transport errors, timeouts, 429/5xx API errors and empty or invalid model
+    output count; 4xx client errors (e.g. a corrupt image) and input errors
+    don't. Wrapped errors are classified by their cause.
+    """
+    while error is not None:
+        if isinstance(error, genai_errors.APIError):
+            return error.code is not None and (error.code == 429 or error.code >= 500)
+        if isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError, InvalidModelOutputError)):
+            return True
+        error = error.__cause__
+    return False
+
 class Song(BaseModel):
     """Pydantic model for song data."""
     Song_title: str
@@ -26,30 +144,67 @@ class Song(BaseModel):
 
 class Songs(BaseModel):
     """Pydantic model for multiple song suggestions."""
-    songs: list[Song]  # List of 3 song suggestions
+    # Exactly 3 suggestions; part of response_schema, so Gemini enforces it server-side
+    songs: list[Song] = Field(min_length=3, max_length=3)
+
+class ImageSongs(BaseModel):
+    """Pydantic model for the song suggestions of one image in a batch."""
+    image_index: int  # 1-based position of the image in the batch
+    # Same bounds as Songs, so the batched response_schema enforces the count too
+    songs: list[Song] = Field(min_length=3, max_length=3)
+
+class BatchedSongs(BaseModel):
+    """Pydantic model for song suggestions covering several images."""
+    results: list[ImageSongs]
 
 class Spotify:
-    """Spotify API client for searching and retrieving track information."""
+    """Async Spotify API client for searching and retrieving track information."""
     
     # Constants
     TOKEN_DURATION = 45 * 60  # 45 minutes in seconds
+    SEARCH_CACHE_SIZE = 2048
+    SEARCH_CACHE_TTL = 60 * 60  # 1 hour in seconds
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.3  # Base delay in seconds, doubled per attempt
+    RETRY_BACKOFF_CAP = 10.0  # Upper bound on a single backoff delay
+    KEEPALIVE_EXPIRY = 120  # Seconds an idle pooled connection stays open
+    RATE_LIMIT = 10  # Max requests started per RATE_WINDOW
+    RATE_WINDOW = 1.0  # Seconds
+    TOKEN_CACHE_DIR = CACHE_DIR
+    TOKEN_EXPIRY_MARGIN = 60  # Treat a token as expired this many seconds early
     AUTH_URL = "https://accounts.spotify.com/api/token"
     SEARCH_URL = "https://api.spotify.com/v1/search"
     
     def __init__(self,
                  client_id: Optional[str] = None,
-                 client_secret: Optional[str] = None) -> None:
+                 client_secret: Optional[str] = None,
+                 http_client: Optional[httpx.AsyncClient] = None) -> None:
         """Initialize Spotify client with credentials.
         
+        No network call is made here; a token is fetched on first use.
+        
         Args:
             client_id: Spotify client ID (defaults to env variable)
             client_secret: Spotify client secret (defaults to env variable)
+            http_client: Optional shared httpx.AsyncClient (one is created if omitted)
             
         Raises:
             ValueError: If credentials are not provided
         """
         self.token: Optional[str] = None
-        self.token_expires_at: float = 0  # Timestamp when token expires
+        self.token_expires_at: float = 0  # time.monotonic() value when token expires
+        self._search_headers: Dict[str, str] = {}
+        
+        # Cache of found tracks keyed by normalized (track, artist).
+        # Only touched from the event loop, so no lock is needed.
+        self._search_cache: TTLCache = TTLCache(maxsize=self.SEARCH_CACHE_SIZE, ttl=self.SEARCH_CACHE_TTL)
+        
+        # Serializes token refreshes across concurrent searches
+        self._token_lock = asyncio.Lock()
+        
+        # Client-side leaky bucket: start times of recent requests, admitted one at a time
+        self._rate_lock = asyncio.Lock()
+        self._request_times: deque = deque(maxlen=self.RATE_LIMIT)
         
         # Use provided credentials or fallback to environment variables
         self.client_id = client_id or os.getenv("SPOTIFY_CLIENT_ID")
@@ -59,11 +214,122 @@ class Spotify:
             raise ValueError("Spotify client ID and secret are required. "
                            "Provide them as parameters or set SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET environment variables.")
             
-        self.auth_str = f"{self.client_id}:{self.client_secret}"
-        self.b64_auth_str = base64.b64encode(self.auth_str.encode()).decode()
+        # Basic auth header for token requests, built once
+        self._auth_header = {
+            "Authorization": "Basic " + base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
+        }
+        
+        # Token cache file scoped to these credentials, so re-runs skip the auth round-trip
+        client_key = hashlib.sha256(self.client_id.encode()).hexdigest()[:16]
+        self._token_cache_path = os.path.join(self.TOKEN_CACHE_DIR, f"spotify_token_{client_key}.json")
+        self._load_cached_token()
+        
+        # Pooled HTTP/2 client: concurrent searches multiplex over one connection,
+        # and idle connections are kept long enough to be reused across requests
+        self._owns_http_client = http_client is None
+        self._http = http_client or httpx.AsyncClient(
+            http2=True,
+            timeout=30,
+            limits=httpx.Limits(
+                max_connections=50,
+                max_keepalive_connections=20,
+                keepalive_expiry=self.KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP client if this instance created it."""
+        if self._owns_http_client:
+            await self._http.aclose()
+
+    async def _throttle(self) -> None:
+        """Wait until another request fits in the RATE_LIMIT per RATE_WINDOW budget."""
+        async with self._rate_lock:
+            while len(self._request_times) >= self.RATE_LIMIT:
+                wait = self._request_times[0] + self.RATE_WINDOW - time.monotonic()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self._request_times.append(time.monotonic())
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request, retrying 429/5xx and transport errors with full-jitter backoff.
+        
+        Every attempt goes through the client-side rate limiter first. Honors
+        Retry-After on 429 responses, returning the response instead of
+        waiting when it exceeds RETRY_BACKOFF_CAP. Other statuses (e.g. 401)
+        are returned for the caller to handle.
+        
+        Raises:
+            httpx.HTTPError: If the request still fails after all retries
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            await self._throttle()
+            try:
+                response = await self._http.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                await asyncio.sleep(_backoff_delay(attempt, self.RETRY_BACKOFF, self.RETRY_BACKOFF_CAP))
+                continue
+            
+            if response.status_code not in RETRYABLE_STATUSES or attempt == self.MAX_RETRIES:
+                return response
+            
+            delay = _retry_after(response.headers)
+            if delay is None:
+                delay = _backoff_delay(attempt, self.RETRY_BACKOFF, self.RETRY_BACKOFF_CAP)
+            elif delay > self.RETRY_BACKOFF_CAP:
+                logger.warning("Spotify asked to retry after %.0fs, giving up", delay)
+                return response
+            logger.info("Spotify returned %s, retrying in %.1fs", response.status_code, delay)
+            await asyncio.sleep(delay)
+        return response
 
-        # Generate token on initialization
-        self._generate_token()
+    def _load_cached_token(self) -> None:
+        """Load a still-valid access token from the on-disk cache, if there is one."""
+        try:
+            with open(self._token_cache_path) as f:
+                data = json.load(f)
+            token, expires_at = data["token"], float(data["expires_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        
+        # The file stores wall-clock time; convert the remaining lifetime to the monotonic clock
+        remaining = expires_at - time.time()
+        if remaining > self.TOKEN_EXPIRY_MARGIN:
+            self.token = token
+            self.token_expires_at = time.monotonic() + remaining
+            self._search_headers = {"Authorization": f"Bearer {self.token}"}
+            logger.info("Loaded cached Spotify access token")
+
+    def _save_cached_token(self, token: str, expires_at: float) -> None:
+        """Persist an access token so later runs can reuse it.
+        
+        Blocking file I/O; call it through asyncio.to_thread. Each write goes
+        to its own temp file, so concurrent workers never clobber each other's
+        half-written cache. Failures are logged and ignored; the cache is only
+        an optimization.
+        
+        Args:
+            token: Spotify access token
+            expires_at: Wall-clock (time.time()) expiry of the token
+        """
+        tmp_path = None
+        try:
+            os.makedirs(self.TOKEN_CACHE_DIR, exist_ok=True)
+            # mkstemp creates the file with owner-only permissions: it holds a bearer token
+            fd, tmp_path = tempfile.mkstemp(dir=self.TOKEN_CACHE_DIR, prefix=".spotify_token_", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"token": token, "expires_at": expires_at}, f)
+            os.replace(tmp_path, self._token_cache_path)
+        except OSError as e:
+            logger.warning("Could not write Spotify token cache: %s", e)
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
 
     def _is_token_valid(self) -> bool:
         """Check if the current token is still valid (not expired).
@@ -71,46 +337,134 @@ class Spotify:
         Returns:
             bool: True if token exists and is not expired, False otherwise
         """
-        return self.token is not None and time.time() < self.token_expires_at
+        return self.token is not None and time.monotonic() < self.token_expires_at - self.TOKEN_EXPIRY_MARGIN
 
-    def _generate_token(self) -> None:
+    async def _generate_token(self) -> None:
         """Generate a new access token from Spotify API.
         
         Raises:
-            requests.RequestException: If API request fails
+            httpx.HTTPError: If API request fails
             ValueError: If response doesn't contain access token
         """
         try:
-            response = requests.post(
+            response = await self._request(
+                "POST",
                 self.AUTH_URL,
-                headers={"Authorization": f"Basic {self.b64_auth_str}"},
+                headers=self._auth_header,
                 data={"grant_type": "client_credentials"},
-                timeout=30  # Add timeout for better reliability
             )
             response.raise_for_status()
 
-            response_data = response.json()
+            response_data = orjson.loads(response.content)
             if "access_token" not in response_data:
                 raise ValueError("No access token in response from Spotify API")
                 
             self.token = response_data["access_token"]
-            self.token_expires_at = time.time() + self.TOKEN_DURATION
+            self.token_expires_at = time.monotonic() + self.TOKEN_DURATION
+            self._search_headers = {"Authorization": f"Bearer {self.token}"}
+            await asyncio.to_thread(self._save_cached_token, self.token, time.time() + self.TOKEN_DURATION)
             logger.info("New Spotify access token generated successfully")
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to get Spotify access token: {e}")
+        except httpx.HTTPError as e:
+            logger.error("Failed to get Spotify access token: %s", e)
             raise
         except (KeyError, ValueError) as e:
-            logger.error(f"Invalid response from Spotify API: {e}")
+            logger.error("Invalid response from Spotify API: %s", e)
             raise
 
-    def _ensure_valid_token(self) -> None:
-        """Ensure we have a valid token, generate new one if expired."""
-        if not self._is_token_valid():
-            logger.info("Spotify token expired or invalid, generating new token...")
-            self._generate_token()
+    async def _ensure_valid_token(self, rejected_token: Optional[str] = None) -> None:
+        """Ensure we have a valid token, generate new one if expired.
+        
+        Concurrent callers share a single refresh.
+        
+        Args:
+            rejected_token: A token Spotify just answered 401 to; it is
+                replaced even if it hasn't expired by the clock
+        """
+        if self._is_token_valid() and self.token != rejected_token:
+            return
+        async with self._token_lock:
+            # Another search may have refreshed while we waited for the lock
+            if not self._is_token_valid() or self.token == rejected_token:
+                logger.info("Spotify token expired or invalid, generating new token...")
+                await self._generate_token()
+
+    async def _search_query(self, query: str) -> Optional[Dict[str, Any]]:
+        """Run one search query and return the top raw track object.
+        
+        On a 401 the token is refreshed once and the query retried.
+        
+        Returns:
+            The first track item, or None if there were no results or the request failed
+        """
+        params = {"q": query, "type": "track", "limit": 1}
+        
+        try:
+            used_token = self.token
+            response = await self._request("GET", self.SEARCH_URL, headers=self._search_headers, params=params)
+            if response.status_code == 401:
+                # Token was revoked before its expiry; refresh once and retry
+                logger.info("Spotify rejected the access token, refreshing and retrying")
+                await self._ensure_valid_token(rejected_token=used_token)
+                response = await self._request("GET", self.SEARCH_URL, headers=self._search_headers, params=params)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+            
+            tracks = data.get("tracks", {}).get("items", [])
+            if not tracks:
+                logger.info("No tracks found for query: %s", query)
+                return None
+            return tracks[0]
+        
+        except httpx.HTTPError as e:
+            logger.error("Error searching for track with query '%s': %s", query, e)
+            return None
+        except (KeyError, IndexError, ValueError, AttributeError) as e:
+            logger.error("Error parsing track data for query '%s': %s", query, e)
+            return None
+
+    async def _search_stage(self, queries: list[str], artist_name: Optional[str], artist_query: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Run queries concurrently and return the parsed track of the highest-priority hit.
+        
+        Args:
+            queries: Search queries, highest priority first
+            artist_name: Artist name the caller asked for
+            artist_query: The field-qualified track:/artist: query, if any
+            
+        Returns:
+            Dict containing track information, or None if no query found a track
+        """
+        tasks = [asyncio.create_task(self._search_query(query)) for query in queries]
+        try:
+            for query, task in zip(queries, tasks):
+                track = await task
+                if not track:
+                    continue
+                
+                logger.info("Track found using query: %s", query)
+                try:
+                    # Only the artist:-qualified query guarantees the caller's artist matched
+                    if artist_name and query == artist_query:
+                        artist = artist_name.strip()
+                    else:
+                        artist = track["artists"][0]["name"] if track.get("artists") else "Unknown"
+                    return {
+                        "id": track["id"],
+                        "name": track["name"],
+                        "artist": artist,
+                        "preview_url": track.get("preview_url"),
+                        "spotify_url": track["external_urls"]["spotify"]
+                    }
+                except (KeyError, IndexError) as e:
+                    logger.error("Error parsing track data for query '%s': %s", query, e)
+                    continue
+        finally:
+            # Lower-priority strategies are no longer needed once one hits
+            for task in tasks:
+                task.cancel()
+        return None
 
-    def search_track(self, track_name: str, artist_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    async def search_track(self, track_name: str, artist_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Search for a track on Spotify.
         
         Args:
@@ -125,69 +479,76 @@ class Spotify:
         """
         if not track_name.strip():
             raise ValueError("Track name cannot be empty")
+        
+        # Serve repeated lookups from the in-process cache
+        cache_key = (track_name.strip().lower(), (artist_name or "").strip().lower())
+        cached = self._search_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Track cache hit for '%s' by '%s'", track_name, artist_name)
+            return cached
             
         # Ensure we have a valid token before making the request
-        self._ensure_valid_token()
+        await self._ensure_valid_token()
 
         # Try multiple search strategies for better results
         search_queries = []
+        track_only_query = f"track:{track_name.strip()}"
+        artist_query = None
         
         if artist_name:
             # Strategy 1: Use only the first artist if multiple artists are present
             if ',' in artist_name:
                 first_artist = artist_name.split(',')[0].strip()
-                search_queries.append(f"track:{track_name.strip()} artist:{first_artist}")
-                logger.info(f"Multiple artists detected, using first artist: {first_artist}")
+                artist_query = f"track:{track_name.strip()} artist:{first_artist}"
+                logger.info("Multiple artists detected, using first artist: %s", first_artist)
             else:
-                search_queries.append(f"track:{track_name.strip()} artist:{artist_name.strip()}")
+                artist_query = f"track:{track_name.strip()} artist:{artist_name.strip()}"
+            search_queries.append(artist_query)
             
             # Strategy 2: Search with track name and full artist string (without field specifiers)
             search_queries.append(f"{track_name.strip()} {artist_name.strip()}")
             
             # Strategy 3: Search with track name only as fallback
-            search_queries.append(f"track:{track_name.strip()}")
+            search_queries.append(track_only_query)
         else:
-            search_queries.append(f"track:{track_name.strip()}")
-            
-        headers = {"Authorization": f"Bearer {self.token}"}
-
-        # Try each search strategy until we find a result
-        for query in search_queries:
-            params = {"q": query, "type": "track", "limit": 1}
+            search_queries.append(track_only_query)
             
-            try:
-                response = requests.get(self.SEARCH_URL, headers=headers, params=params, timeout=30)
-                response.raise_for_status()
-                data = response.json()
-
-                tracks = data.get("tracks", {}).get("items", [])
-                if tracks:
-                    track = tracks[0]
-                    logger.info(f"Track found using query: {query}")
-                    return {
-                        "id": track["id"],
-                        "name": track["name"],
-                        "artist": track["artists"][0]["name"] if track.get("artists") else "Unknown",
-                        "preview_url": track.get("preview_url"),
-                        "spotify_url": track["external_urls"]["spotify"]
-                    }
-                else:
-                    logger.info(f"No tracks found for query: {query}")
-                    
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error searching for track with query '{query}': {e}")
-                continue
-            except (KeyError, IndexError) as e:
-                logger.error(f"Error parsing track data for query '{query}': {e}")
-                continue
+        # A plain single-artist name almost always matches the field-qualified query,
+        # so try it alone first; otherwise run every strategy concurrently
+        simple_artist = bool(artist_name) and ',' not in artist_name and len(artist_name.strip()) < 40 and artist_name.isascii()
+        stages = [search_queries[:1], search_queries[1:]] if simple_artist else [search_queries]
+        
+        for stage in stages:
+            track_info = await self._search_stage(stage, artist_name, artist_query)
+            if track_info:
+                self._search_cache[cache_key] = track_info
+                return track_info
         
         # If all strategies failed
-        logger.warning(f"All search strategies failed for track '{track_name}' by '{artist_name}'")
+        logger.warning("All search strategies failed for track '%s' by '%s'", track_name, artist_name)
         return None
 
 class Gemini:
     """Google Gemini AI client for image analysis and song suggestion."""
     
+    # Constants
+    GROUNDED_MODEL = "gemini-2.5-flash"
+    GROUNDED_TOOLS = [{"google_search": {}}]
+    LARGE_IMAGE_BYTES = 4 * 1024 * 1024  # Upload images above this via the Files API instead of inlining
+    INLINE_REQUEST_BYTES = 14 * 1024 * 1024  # Raw inline bytes per request; base64 keeps it under the 20 MB limit
+    RESULT_CACHE_DIR = os.path.join(CACHE_DIR, "suggestions")
+    RESULT_CACHE_TTL = 24 * 60 * 60  # 24 hours in seconds
+    CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failed generations before failing fast
+    CIRCUIT_OPEN_SECONDS = 30  # How long to fail fast before trying Gemini again
+    GROUNDED_SAMPLING = {
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "max_output_tokens": 400,  # 3-song JSON is ~200 tokens; caps runaway decodes
+        "candidate_count": 1,
+        # 2.5-flash counts thinking toward max_output_tokens; don't let it eat the budget
+        "thinking_config": types.ThinkingConfig(thinking_budget=0),
+    }
+    
     def __init__(self, api_key: Optional[str] = None) -> None:
         """Initialize Gemini client with API key.
         
@@ -204,6 +565,46 @@ class Gemini:
                            "Provide it as parameter or set GOOGLE_API_KEY environment variable.")
 
         self.client = self._initialize_client()
+        
+        # Generation configs are built once and reused across calls
+        self._grounded_config = types.GenerateContentConfig(
+            system_instruction=GROUNDED_SYSTEM_INSTRUCTION,
+            tools=self.GROUNDED_TOOLS,
+            **self.GROUNDED_SAMPLING,
+        )
+        self._structure_config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=Songs,
+            temperature=0.1,
+        )
+        self._fallback_config = types.GenerateContentConfig(
+            system_instruction=FALLBACK_SYSTEM_INSTRUCTION,
+            response_mime_type="application/json",
+            response_schema=Songs,
+            temperature=0.5,
+            top_p=0.95,
+            top_k=40,
+            max_output_tokens=800,
+        )
+        self._batch_config = types.GenerateContentConfig(
+            system_instruction=FALLBACK_SYSTEM_INSTRUCTION,
+            response_mime_type="application/json",
+            response_schema=BatchedSongs,
+            temperature=0.5,
+            top_p=0.95,
+            top_k=40,
+        )
+        
+        # Static prompt prefixes, sent ahead of the image so requests share a prefix
+        # Gemini can reuse through implicit caching
+        self._grounded_prefix = prompt_prefix(use_grounding=True)
+        self._fallback_prefix = prompt_prefix(use_grounding=False)
+        
+        # Circuit breaker over whole generations, shared by all worker threads
+        self._circuit_failures = 0
+        self._circuit_open_until: float = 0
+        self._circuit_trial_in_flight = False  # One trial call is let through once the breaker's window ends
+        self._circuit_lock = Lock()
 
     def _initialize_client(self) -> genai.Client:
         """Initialize the Gemini AI client.
@@ -222,14 +623,18 @@ class Gemini:
             logger.info("Gemini AI client initialized successfully")
             return client
         except Exception as e:
-            logger.error(f"Could not initialize Gemini client: {e}")
+            logger.error("Could not initialize Gemini client: %s", e)
             raise
 
-    def _read_image_bytes(self, image_path: str) -> bytes:
-        """Read image file as bytes.
+    def _grounded_contents(self, image_part: types.Part, suffix: str) -> list:
+        """Build the contents for a grounded call: static prefix, then image, then per-request suffix."""
+        return [self._grounded_prefix, image_part, suffix]
+
+    def _read_image_bytes(self, image: bytes | str) -> bytes:
+        """Read image data as bytes.
         
         Args:
-            image_path: Path to the image file
+            image: Raw image bytes, or path to the image file
             
         Returns:
             Image data as bytes
@@ -238,6 +643,12 @@ class Gemini:
             FileNotFoundError: If image file doesn't exist
             IOError: If file cannot be read
         """
+        if isinstance(image, (bytes, bytearray)):
+            if not image:
+                raise IOError("Image data is empty")
+            return bytes(image)
+        
+        image_path = image
         if not image_path:
             raise ValueError("Image path cannot be empty")
             
@@ -250,12 +661,42 @@ class Gemini:
                 
             return image_data
         except FileNotFoundError:
-            logger.error(f"Image file not found: {image_path}")
+            logger.error("Image file not found: %s", image_path)
             raise
         except IOError as e:
-            logger.error(f"Error reading image file {image_path}: {e}")
+            logger.error("Error reading image file %s: %s", image_path, e)
             raise
             
+    def _image_part(self, image_bytes: bytes, mime_type: str, inline_limit: Optional[int] = None) -> types.Part:
+        """Build the request part for an image.
+        
+        Small images are inlined. Larger images are uploaded through the Files
+        API and referenced by URI, so the request body does not carry a base64
+        copy of the whole image. Uploaded files expire on their own after 48
+        hours.
+        
+        Args:
+            image_bytes: Raw image data
+            mime_type: MIME type of the image (e.g. image/jpeg)
+            inline_limit: Max bytes to inline (defaults to LARGE_IMAGE_BYTES)
+            
+        Returns:
+            Part to include in `contents`
+        """
+        if inline_limit is None:
+            inline_limit = self.LARGE_IMAGE_BYTES
+        if len(image_bytes) > inline_limit:
+            try:
+                uploaded = self.client.files.upload(
+                    file=io.BytesIO(image_bytes),
+                    config=types.UploadFileConfig(mime_type=mime_type),
+                )
+                logger.info("Uploaded large image (%s bytes) via Files API", len(image_bytes))
+                return types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type or mime_type)
+            except Exception as e:
+                logger.warning("Files API upload failed, sending the image inline: %s", e)
+        return types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+
     def _detect_mime_type(self, image_path: str) -> str:
         """Detect MIME type of the image file.
         
@@ -268,45 +709,23 @@ class Gemini:
         Raises:
             ValueError: If MIME type cannot be detected
         """
-        # Initialize mimetypes if needed
-        if not mimetypes.inited:
-            mimetypes.init()
-            
-        # Get MIME type based on file extension
-        mime_type, _ = mimetypes.guess_type(image_path)
+        # Extension lookup: system MIME database first, then common image types
+        mime_type = mimetypes.guess_type(image_path)[0] or _EXT_MIME.get(os.path.splitext(image_path)[1].lower())
         
-        # If MIME type couldn't be detected from extension, try to determine by common image extensions
-        if not mime_type:
-            # Map common image extensions to MIME types
-            extension_map = {
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.png': 'image/png',
-                '.gif': 'image/gif',
-                '.bmp': 'image/bmp',
-                '.webp': 'image/webp'
-            }
-            
-            file_ext = os.path.splitext(image_path.lower())[1]
-            mime_type = extension_map.get(file_ext)
-            
         # Default to image/jpeg if we still couldn't determine the MIME type
         if not mime_type:
-            logger.warning(f"Could not detect MIME type for {image_path}, defaulting to image/jpeg")
+            logger.warning("Could not detect MIME type for %s, defaulting to image/jpeg", image_path)
             mime_type = 'image/jpeg'
             
-        logger.info(f"Detected MIME type for {image_path}: {mime_type}")
+        logger.debug("Detected MIME type for %s: %s", image_path, mime_type)
         return mime_type
 
     
 
     def song_title_gen(self, image_path: str, language: str = "English", genre: str = None, context: str = None) -> str:
-        """Generate multiple song suggestions based on image analysis with multi-level fallback.
+        """Generate multiple song suggestions for an image file on disk.
         
-        Strategy:
-        1. Try Google Search grounding with text output (most creative + trending)
-        2. If JSON parsing fails, use structured output to convert
-        3. If grounding fails entirely, fall back to normal structured output
+        Reads the file and delegates to `song_title_gen_bytes`.
         
         Args:
             image_path: Path to the image file
@@ -321,52 +740,193 @@ class Gemini:
             FileNotFoundError: If image file doesn't exist
             Exception: If all generation methods fail
         """
-        # Build prompt and detect MIME type (genre is no longer used)
-        genre_text = ""
         mime_type = self._detect_mime_type(image_path)
         image_bytes = self._read_image_bytes(image_path)
         
+        cache_path = self._result_cache_path(image_bytes, language, genre, context)
+        cached = self._load_cached_result(cache_path)
+        if cached:
+            logger.info("✅ Using cached suggestions for this image")
+            return cached
+        
+        song_json = self.song_title_gen_bytes(image_bytes, mime_type, language=language, genre=genre, context=context)
+        self._save_cached_result(cache_path, song_json)
+        return song_json
+
+    def _result_cache_path(self, image_bytes: bytes, language: str, genre: Optional[str], context: Optional[str]) -> str:
+        """Build the on-disk cache path for an image and its request options."""
+        key = prompt_cache_key(language, genre, context, True, hashlib.sha256(image_bytes).hexdigest())
+        return os.path.join(self.RESULT_CACHE_DIR, f"{key}.json")
+
+    def _load_cached_result(self, cache_path: str) -> Optional[str]:
+        """Return cached suggestions if the cache file exists and has not expired."""
+        try:
+            if time.time() - os.path.getmtime(cache_path) > self.RESULT_CACHE_TTL:
+                return None
+            with open(cache_path, encoding="utf-8") as f:
+                return f.read() or None
+        except OSError:
+            return None
+
+    def _save_cached_result(self, cache_path: str, song_json: str) -> None:
+        """Write suggestions to the on-disk cache, ignoring failures.
+        
+        Each write goes to its own temp file, so concurrent writers never
+        clobber each other's half-written entry.
+        """
+        tmp_path = None
+        try:
+            os.makedirs(self.RESULT_CACHE_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.RESULT_CACHE_DIR, prefix=".suggestion_", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(song_json)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning("Could not write suggestion cache: %s", e)
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def song_title_gen_bytes(self, image_bytes: bytes, mime_type: str, language: str = "English", genre: str = None, context: str = None) -> str:
+        """Generate multiple song suggestions based on image analysis with multi-level fallback.
+        
+        Strategy:
+        1. Try Google Search grounding, asking for JSON and parsing it locally (most creative + trending)
+        2. If local JSON parsing fails, use structured output to convert
+        3. If grounding fails entirely, fall back to normal structured output
+        
+        Args:
+            image_bytes: Raw image data (e.g. an in-memory upload)
+            mime_type: MIME type of the image (e.g. image/jpeg)
+            language: Language preference for the song (default: English)
+            genre: Optional genre preference (deprecated, kept for backward compatibility)
+            context: Optional user-provided context about the image
+            
+        Returns:
+            JSON string containing 3 song suggestions
+            
+        Raises:
+            IOError: If image data is empty
+            CircuitOpenError: If Gemini has failed repeatedly and is being skipped
+            Exception: If all generation methods fail
+        """
+        image_bytes = self._read_image_bytes(image_bytes)
+        
+        is_trial = self._check_circuit()
+        try:
+            song_json = self._generate_with_fallback(image_bytes, mime_type, language, context)
+        except Exception as e:
+            self._record_failure(e, is_trial)
+            raise
+        self._record_success(is_trial)
+        return song_json
+
+    def _check_circuit(self) -> bool:
+        """Fail fast while the circuit breaker is open.
+        
+        Once the open window ends, a single trial call is let through; its
+        outcome closes or reopens the breaker. Other callers keep failing fast
+        while the trial is in flight.
+        
+        Returns:
+            True if this call is the breaker's trial call
+            
+        Raises:
+            CircuitOpenError: If recent generations kept failing
+        """
+        with self._circuit_lock:
+            if self._circuit_failures < self.CIRCUIT_FAILURE_THRESHOLD:
+                return False
+            remaining = self._circuit_open_until - time.monotonic()
+            if remaining <= 0 and not self._circuit_trial_in_flight:
+                self._circuit_trial_in_flight = True
+                logger.info("🔁 Letting a trial call through to Gemini")
+                return True
+        raise CircuitOpenError(max(remaining, 1.0))
+
+    def check_available(self) -> None:
+        """Raise if a generation would be rejected by the circuit breaker right now.
+        
+        Unlike _check_circuit this never claims the trial slot, so callers can
+        probe before committing to a response (e.g. before streaming).
+        
+        Raises:
+            CircuitOpenError: If recent generations kept failing
+        """
+        with self._circuit_lock:
+            if self._circuit_failures < self.CIRCUIT_FAILURE_THRESHOLD:
+                return
+            remaining = self._circuit_open_until - time.monotonic()
+            if remaining <= 0 and not self._circuit_trial_in_flight:
+                return
+        raise CircuitOpenError(max(remaining, 1.0))
+
+    def _record_success(self, is_trial: bool = False) -> None:
+        """Close the circuit breaker after a successful generation."""
+        with self._circuit_lock:
+            self._circuit_failures = 0
+            self._circuit_open_until = 0
+            if is_trial:
+                self._circuit_trial_in_flight = False
+
+    def _record_failure(self, error: BaseException, is_trial: bool = False) -> None:
+        """Count a failed generation and open the circuit breaker past the threshold.
+        
+        Only provider-side failures count; a request Gemini rejects as invalid
+        says nothing about Gemini's health. Once open, the count stays at the
+        threshold, so a failed trial call reopens the breaker.
+        """
+        with self._circuit_lock:
+            if is_trial:
+                self._circuit_trial_in_flight = False
+            if not _is_provider_failure(error):
+                return
+            self._circuit_failures += 1
+            if self._circuit_failures >= self.CIRCUIT_FAILURE_THRESHOLD:
+                self._circuit_open_until = time.monotonic() + self.CIRCUIT_OPEN_SECONDS
+                logger.error("🚫 Gemini failed %s times in a row, failing fast for %ss",
+                             self._circuit_failures, self.CIRCUIT_OPEN_SECONDS)
+
+    def _release_trial(self, is_trial: bool) -> None:
+        """Give up the trial slot without an outcome (e.g. the caller went away)."""
+        if is_trial:
+            with self._circuit_lock:
+                self._circuit_trial_in_flight = False
+
+    def _generate_with_fallback(self, image_bytes: bytes, mime_type: str, language: str, context: Optional[str], image_part: Optional[types.Part] = None) -> str:
+        """Run the grounded → structured → fallback generation ladder for one image.
+        
+        Args:
+            image_bytes: Raw image data
+            mime_type: MIME type of the image (e.g. image/jpeg)
+            language: Language preference for the songs
+            context: Optional user-provided context about the image
+            image_part: Already-built image part to reuse (e.g. an uploaded file)
+            
+        Returns:
+            JSON string containing 3 song suggestions
+            
+        Raises:
+            Exception: If all generation methods fail
+        """
+        # Build prompt (genre is no longer used)
+        genre_text = ""
+        
+        # Build the image part and the per-request prompt suffix once; retries and fallbacks reuse them
+        if image_part is None:
+            image_part = self._image_part(image_bytes, mime_type)
+        suffix = prompt_suffix(language, genre_text, context)
+        
         # APPROACH 1: Try Google Search grounding (best for trending songs)
         try:
             logger.info("🔍 Attempting Google Search grounding for trending songs...")
-            # Use grounding-enabled prompt
-            prompt = main_prompt(language, genre_text, context, use_grounding=True)
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=[
-                    types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
-                    prompt
-                ],
-                config=types.GenerateContentConfig(
-                    system_instruction="""You are an expert music curator for Instagram stories and reels.
-
-YOUR WORKFLOW:
-1. ANALYZE THE IMAGE: Identify mood, setting, activity, colors, and aesthetic
-2. CRAFT SPECIFIC SEARCH QUERIES: Combine the visual analysis with language/genre to search for matching trending songs
-   - Include image-specific context in queries (e.g., "beach sunset vibes", "city night energy", "melancholic rainy day")
-   - Don't just search "trending hindi songs" - search "trending hindi romantic beach sunset songs october 2025"
-3. SELECT PERFECT MATCHES: Choose songs that match BOTH the trending status AND the specific image vibe for young users.
-
-CRITICAL:
-- Your Google Search queries MUST incorporate the visual analysis from the image
-- Match songs to the SPECIFIC emotional and visual mood of the image, not just general trends
-- Always provide real, existing songs with accurate titles and artist names
-- Return ONLY valid JSON with exactly 3 songs by different artists
-
-Example of GOOD search query formation:
-Image shows: Golden hour beach photo with couple
-Search: "trending hindi romantic beach golden hour songs instagram"
-
-Example of BAD search query:
-Image shows: Golden hour beach photo with couple  
-Search: "trending hindi songs october 2025" ❌ (too generic, missing image context)""",
-                    tools=[{"google_search": {}}],
-                    temperature=0.7,
-                    top_p=0.95,
-                    top_k=40,
-                    max_output_tokens=2000,
-                    candidate_count=1,
-                )
+            response = _retry(
+                self.client.models.generate_content,
+                model=self.GROUNDED_MODEL,
+                contents=self._grounded_contents(image_part, suffix),
+                config=self._grounded_config
             )
 
             if response.text:
@@ -377,153 +937,383 @@ Search: "trending hindi songs october 2025" ❌ (too generic, missing image cont
                         if hasattr(candidate, 'grounding_metadata') and candidate.grounding_metadata:
                             grounding_meta = candidate.grounding_metadata
                             if hasattr(grounding_meta, 'web_search_queries') and grounding_meta.web_search_queries:
-                                logger.info(f"   Search queries: {grounding_meta.web_search_queries}")
+                                logger.info("   Search queries: %s", grounding_meta.web_search_queries)
                             if hasattr(grounding_meta, 'grounding_chunks') and grounding_meta.grounding_chunks:
-                                logger.info(f"   Grounded with {len(grounding_meta.grounding_chunks)} web sources")
+                                logger.info("   Grounded with %s web sources", len(grounding_meta.grounding_chunks))
                 except Exception as meta_error:
-                    logger.debug(f"Could not extract grounding metadata: {meta_error}")
+                    logger.debug("Could not extract grounding metadata: %s", meta_error)
                 
                 grounded_text = response.text
-                logger.info(f"   Received grounded response ({len(grounded_text)} chars)")
+                logger.info("   Received grounded response (%s chars)", len(grounded_text))
+                
+                # Parse the grounded JSON locally; no second model call needed
+                local_json = self._parse_grounded_json(grounded_text)
+                if local_json:
+                    logger.info("✅ Parsed grounded response as JSON")
+                    return local_json
                 
-                # APPROACH 2: Always use structured output to convert grounded text to JSON
-                # (Skip JSON parsing as it frequently fails)
+                # APPROACH 2: Only if local parsing fails, convert with structured output
                 try:
                     logger.info("🔄 Converting grounded response to JSON with structured output...")
-                    structure_response = self.client.models.generate_content(
+                    structure_response = _retry(
+                        self.client.models.generate_content,
                         model="gemini-2.0-flash-001",
                         contents=f"""Extract song suggestions from this text as JSON with exactly 3 songs:
 
 {grounded_text}""",
-                        config=types.GenerateContentConfig(
-                            response_mime_type="application/json",
-                            response_schema=Songs,
-                            temperature=0.1,
-                        )
+                        config=self._structure_config
                     )
                     
                     if structure_response.text:
                         # Validate the structured response
-                        validated = json.loads(structure_response.text)
-                        if "songs" in validated and len(validated["songs"]) >= 3:
+                        validated = self._validate_songs_json(structure_response.text)
+                        if validated:
                             logger.info("✅ Successfully converted grounded response to JSON")
-                            return structure_response.text
+                            return validated
                 except Exception as convert_error:
-                    logger.warning(f"   Conversion failed: {convert_error}")
+                    logger.warning("   Conversion failed: %s", convert_error)
         
         except Exception as grounding_error:
-            logger.warning(f"⚠️  Grounding approach failed: {grounding_error}")
+            logger.warning("⚠️  Grounding approach failed: %s", grounding_error)
         
         # APPROACH 3: Fallback to normal structured output (no grounding)
         try:
             logger.info("🔄 Falling back to standard structured output (no grounding)...")
-            # Use non-grounding prompt (no mention of Google Search)
-            fallback_prompt = main_prompt(language, genre_text, context, use_grounding=False)
-            response = self.client.models.generate_content(
+            response = _retry(
+                self.client.models.generate_content,
                 model="gemini-2.0-flash-001",
-                contents=[
-                    types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
-                    fallback_prompt
-                ],
-                config=types.GenerateContentConfig(
-                    system_instruction="""You are an expert music curator for Instagram.
-Suggest songs that match the image's mood and vibe.
-Provide real, existing songs with accurate titles and artist names.""",
-                    response_mime_type="application/json",
-                    response_schema=Songs,
-                    temperature=0.5,
-                    top_p=0.95,
-                    top_k=40,
-                    max_output_tokens=800,
-                )
+                contents=[self._fallback_prefix, image_part, suffix],
+                config=self._fallback_config
             )
             
             if response.text:
                 # Validate the response
-                validated = json.loads(response.text)
-                if "songs" in validated and len(validated["songs"]) >= 3:
+                validated = self._validate_songs_json(response.text)
+                if validated:
                     logger.info("✅ Standard structured output successful")
-                    return response.text
+                    return validated
                 else:
-                    raise ValueError("Invalid song count in fallback response")
+                    raise InvalidModelOutputError("Invalid song count in fallback response")
             else:
-                raise ValueError("Empty response from fallback method")
+                raise InvalidModelOutputError("Empty response from fallback method")
                 
         except Exception as fallback_error:
-            logger.error(f"❌ All approaches failed. Last error: {fallback_error}")
-            raise Exception(f"Failed to generate song suggestions after all attempts: {fallback_error}")
-        
-
+            logger.error("❌ All approaches failed. Last error: %s", fallback_error)
+            raise Exception(f"Failed to generate song suggestions after all attempts: {fallback_error}") from fallback_error
 
+    @staticmethod
+    def _validate_songs_json(text: str) -> Optional[str]:
+        """Validate model output against the `Songs` schema.
+        
+        Output with more than 3 songs (e.g. free-form grounded text) is cut
+        to the first 3 rather than rejected.
+        
+        Returns:
+            Normalized JSON string if it holds at least 3 complete songs, otherwise None
+        """
+        try:
+            data = orjson.loads(text)
+            if isinstance(data, dict) and isinstance(data.get("songs"), list):
+                data["songs"] = data["songs"][:3]
+            parsed = Songs.model_validate(data)
+        except ValueError:
+            return None
+        if not all(song.Song_title and song.Artist for song in parsed.songs):
+            return None
+        return parsed.model_dump_json()
 
-def main(image_path, language, genre) -> None:
-    """Main function to demonstrate the song suggestion workflow."""
-    try:
-        # Initialize AI client
-        logger.info("Initializing Gemini AI client...")
-        gemini_client = Gemini()
+    @classmethod
+    def _parse_grounded_json(cls, text: str) -> Optional[str]:
+        """Parse song suggestions from grounded free-form output without another model call.
         
-        # Configure image and preferences
-        image_path = image_path
-        language = "English" if not language else language
-        genre = genre
+        Tries, in order: the whole text as JSON, the outermost {...} block
+        (e.g. inside a code fence), then individual song objects.
         
-        # Log detected MIME type (for debugging purposes)
-        mime_type = gemini_client._detect_mime_type(image_path)
-        logger.info(f"Detected MIME type for input image: {mime_type}")
+        Returns:
+            JSON string with at least 3 songs, or None if none of the strategies work
+        """
+        validated = cls._validate_songs_json(text)
+        if validated:
+            return validated
         
-        # Generate song suggestion
-        logger.info(f"Generating song suggestion for image: {image_path}")
-        song_json = gemini_client.song_title_gen(image_path, language=language, genre=genre)
+        block = _JSON_BLOCK_RE.search(text)
+        if block:
+            validated = cls._validate_songs_json(block.group(0))
+            if validated:
+                return validated
         
-        print(f"\nAI Song Suggestion:\n{song_json}\n")
-        print("=" * 50)
-        print("SEARCHING FOR SONG ON SPOTIFY...")
-        print("=" * 50)
+        songs = cls._extract_songs(text)
+        if len(songs) >= 3:
+            return json.dumps({"songs": songs[:3]})
+        return None
+
+    @staticmethod
+    def _extract_songs(text: str) -> list[Dict[str, str]]:
+        """Extract every complete song object with a title and artist from (possibly partial) model output."""
+        songs = []
+        for match in _SONG_OBJECT_RE.finditer(text):
+            try:
+                title, artist = (json.loads(f'"{value}"') for value in match.groups())
+            except ValueError:
+                continue
+            if not title.strip() or not artist.strip():
+                continue
+            songs.append({"Song_title": title, "Artist": artist})
+        return songs
 
-        # Parse song data and search on Spotify
+    async def song_title_stream(self, image_bytes: bytes, mime_type: str, language: str = "English", genre: str = None, context: str = None) -> AsyncIterator[Dict[str, str]]:
+        """Yield song suggestions one at a time as the grounded Gemini response streams in.
+        
+        Each song is yielded as soon as its JSON object is complete in the
+        stream. If the stream fails or yields fewer than 3 songs, the regular
+        generation ladder fills in the rest, reusing the stream's image part.
+        
+        Args:
+            image_bytes: Raw image data (e.g. an in-memory upload)
+            mime_type: MIME type of the image (e.g. image/jpeg)
+            language: Language preference for the song (default: English)
+            genre: Optional genre preference (deprecated, kept for backward compatibility)
+            context: Optional user-provided context about the image
+            
+        Yields:
+            Dicts with Song_title and Artist keys (at most 3)
+            
+        Raises:
+            CircuitOpenError: If Gemini has failed repeatedly and is being skipped
+            Exception: If no songs could be generated at all
+        """
+        genre_text = ""
+        image_bytes = self._read_image_bytes(image_bytes)
+        is_trial = self._check_circuit()
+        settled = False  # Whether this call's outcome reached the breaker
         try:
-            song_data = json.loads(song_json)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse song data: {e}")
-            return
+            seen = set()
+            image_part = None
+        
+            try:
+                logger.info("🔍 Streaming Google Search grounded suggestions...")
+                suffix = prompt_suffix(language, genre_text, context)
             
-        track_title = song_data.get("Song_title")
-        artist_name = song_data.get("Artist")
+                # Large-image upload is a blocking call; keep it off the event loop
+                image_part = await asyncio.to_thread(self._image_part, image_bytes, mime_type)
+            
+                text = ""
+                stream = await self.client.aio.models.generate_content_stream(
+                    model=self.GROUNDED_MODEL,
+                    contents=self._grounded_contents(image_part, suffix),
+                    config=self._grounded_config
+                )
+                async for chunk in stream:
+                    if not chunk.text:
+                        continue
+                    text += chunk.text
+                    for song in self._extract_songs(text):
+                        key = (song["Song_title"].lower(), song["Artist"].lower())
+                        if key in seen or len(seen) >= 3:
+                            continue
+                        seen.add(key)
+                        yield song
+            except Exception as stream_error:
+                logger.warning("⚠️  Streaming grounded approach failed: %s", stream_error)
         
-        if not track_title or not artist_name:
-            logger.error("Invalid song data: missing title or artist")
-            return
+            if len(seen) >= 3:
+                self._record_success(is_trial)
+                settled = True
+                return
+        
+            # Fill in whatever the stream didn't deliver with the regular pipeline
+            logger.info("🔄 Stream produced %s songs, completing with standard generation...", len(seen))
+            try:
+                # Reuse the stream's image part so a large image is not uploaded twice
+                song_json = await asyncio.to_thread(
+                    self._generate_with_fallback, image_bytes, mime_type, language, context, image_part
+                )
+            except Exception as e:
+                self._record_failure(e, is_trial)
+                settled = True
+                if seen:
+                    return
+                raise
+            self._record_success(is_trial)
+            settled = True
+        
+            for song in orjson.loads(song_json).get("songs", []):
+                key = (song["Song_title"].lower(), song["Artist"].lower())
+                if key in seen or len(seen) >= 3:
+                    continue
+                seen.add(key)
+                yield song
+        finally:
+            if not settled:
+                # E.g. the client disconnected mid-stream; free the trial slot for the next caller
+                self._release_trial(is_trial)
 
-        # Initialize Spotify client and search
-        logger.info("Initializing Spotify client...")
-        spotify_client = Spotify()
+    def song_title_gen_batch(self, images: list[tuple[bytes, str]], language: str = "English", genre: str = None, contexts: list[Optional[str]] = None) -> list[Optional[str]]:
+        """Generate song suggestions for several images in a single Gemini call.
         
-        logger.info(f"Searching for track: '{track_title}' by '{artist_name}'")
-        track_info = spotify_client.search_track(track_title, artist_name)
+        Uses structured output without Google Search grounding, since the
+        search tool and a response schema can't be combined in one call.
         
-        if track_info:
-            print(f"\nSpotify Track Found:")
-            print(f"Title: {track_info['name']}")
-            print(f"Artist: {track_info['artist']}")
-            print(f"Spotify URL: {track_info['spotify_url']}")
+        Args:
+            images: (image_bytes, mime_type) pairs, in order
+            language: Language preference for the songs (default: English)
+            genre: Optional genre preference (deprecated, kept for backward compatibility)
+            contexts: Optional user-provided context per image (same order as images)
+            
+        Returns:
+            One JSON string (same shape as song_title_gen_bytes) per image, or
+            None for images the model returned no valid result for
             
-            # Ask user if they want to open in browser
-            user_choice = input("\nOpen song in browser? (y/n): ").strip().lower()
+        Raises:
+            CircuitOpenError: If Gemini has failed repeatedly and is being skipped
+            Exception: If the batched call fails
+        """
+        is_trial = self._check_circuit()
+        try:
+            results = self._generate_batch(images, language, contexts)
+        except Exception as e:
+            self._record_failure(e, is_trial)
+            raise
+        self._record_success(is_trial)
+        return results
+
+    def _generate_batch(self, images: list[tuple[bytes, str]], language: str, contexts: Optional[list[Optional[str]]]) -> list[Optional[str]]:
+        """Run the single batched structured-output call behind song_title_gen_batch."""
+        genre_text = ""
+        contexts = contexts or [None] * len(images)
+        
+        # Inline images until the request budget runs out, then upload the rest
+        contents = []
+        inline_budget = self.INLINE_REQUEST_BYTES
+        for idx, (image_bytes, mime_type) in enumerate(images):
+            image_bytes = self._read_image_bytes(image_bytes)
+            image_part = self._image_part(image_bytes, mime_type, inline_limit=min(self.LARGE_IMAGE_BYTES, inline_budget))
+            if image_part.inline_data is not None:
+                inline_budget -= len(image_bytes)
+            contents.append(f"Image {idx + 1}:")
+            contents.append(image_part)
+        items = [{"id": idx + 1, "context": context} for idx, context in enumerate(contexts)]
+        contents.append(batched_main_prompt(language, genre_text, items))
+        
+        logger.info("📦 Generating suggestions for a batch of %s images...", len(images))
+        response = _retry(
+            self.client.models.generate_content,
+            model="gemini-2.0-flash-001",
+            contents=contents,
+            config=self._batch_config.model_copy(update={"max_output_tokens": 800 * len(images)})
+        )
+        if not response.text:
+            raise InvalidModelOutputError("Empty response from batched generation")
+        
+        try:
+            batch = BatchedSongs.model_validate_json(response.text)
+        except ValidationError as e:
+            raise InvalidModelOutputError("Invalid batched generation response") from e
+        results: list[Optional[str]] = [None] * len(images)
+        for result in batch.results:
+            idx = result.image_index - 1
+            if 0 <= idx < len(images):
+                results[idx] = Songs(songs=result.songs).model_dump_json()
+        
+        logger.info("✅ Batched generation returned %s/%s results", sum(r is not None for r in results), len(images))
+        return results
+        
+
+
+
+async def main(image_path, language, genre) -> None:
+    """Main function to demonstrate the song suggestion workflow."""
+    # Configure image and preferences
+    language = "English" if not language else language
+    
+    try:
+        # One pooled HTTP/2 client for every Spotify call in this run
+        async with httpx.AsyncClient(http2=True, timeout=30) as http_client:
+            # Spotify is optional here: without it we still print Gemini's suggestions
+            logger.info("Initializing Spotify client...")
+            spotify_client = None
+            token_task = None
+            try:
+                spotify_client = Spotify(http_client=http_client)
+                # Fetch the Spotify token in the background while Gemini (multi-second) runs
+                token_task = asyncio.create_task(spotify_client._ensure_valid_token())
+            except ValueError as e:
+                logger.warning("Spotify unavailable, skipping track search: %s", e)
+            try:
+                # Gemini's SDK calls are blocking; run them in a worker thread
+                logger.info("Initializing Gemini AI client...")
+                gemini_client = await asyncio.to_thread(Gemini)
+                
+                # Log detected MIME type (for debugging purposes)
+                mime_type = gemini_client._detect_mime_type(image_path)
+                logger.info("Detected MIME type for input image: %s", mime_type)
+                
+                logger.info("Generating song suggestions for image: %s", image_path)
+                song_json = await asyncio.to_thread(
+                    gemini_client.song_title_gen, image_path, language=language, genre=genre
+                )
+                print(f"\nAI Song Suggestions:\n{song_json}\n")
+                
+                if token_task is not None:
+                    try:
+                        await token_task
+                    except Exception as e:
+                        # search_track fetches the token again; a failure here is only a warning
+                        logger.warning("Background Spotify token fetch failed: %s", e)
+            finally:
+                if token_task is not None:
+                    token_task.cancel()
+            
+            if spotify_client is None:
+                return
+            
+            print("=" * 50)
+            print("SEARCHING FOR SONGS ON SPOTIFY...")
+            print("=" * 50)
+            
+            # Parse song data and search on Spotify
+            try:
+                songs = orjson.loads(song_json).get("songs", [])
+            except orjson.JSONDecodeError as e:
+                logger.error("Failed to parse song data: %s", e)
+                return
+            
+            songs = [song for song in songs if song.get("Song_title") and song.get("Artist")]
+            if not songs:
+                logger.error("Invalid song data: missing title or artist")
+                return
+            
+            results = await asyncio.gather(*(
+                spotify_client.search_track(song["Song_title"], song["Artist"]) for song in songs
+            ))
+        
+        found_tracks = []
+        for song, track_info in zip(songs, results):
+            if track_info:
+                print(f"\nSpotify Track Found:")
+                print(f"Title: {track_info['name']}")
+                print(f"Artist: {track_info['artist']}")
+                print(f"Spotify URL: {track_info['spotify_url']}")
+                found_tracks.append(track_info)
+            else:
+                logger.warning("No Spotify track found for '%s' by '%s'", song['Song_title'], song['Artist'])
+                print(f"\nSorry, couldn't find '{song['Song_title']}' on Spotify. Try searching manually.")
+        
+        if found_tracks:
+            # Ask user if they want to open the first match in browser
+            track_info = found_tracks[0]
+            user_choice = (await asyncio.to_thread(input, f"\nOpen '{track_info['name']}' in browser? (y/n): ")).strip().lower()
             if user_choice in ['y', 'yes']:
                 webbrowser.open(track_info['spotify_url'])
                 logger.info("Opened song in browser")
             else:
                 print(f"\nYou can manually open: {track_info['spotify_url']}")
-        else:
-            logger.warning(f"No Spotify track found for '{track_title}' by '{artist_name}'")
-            print("\nSorry, couldn't find this song on Spotify. Try searching manually.")
             
     except ValueError as e:
-        logger.error(f"Configuration error: {e}")
+        logger.error("Configuration error: %s", e)
         print(f"Error: {e}")
     except Exception as e:
-        logger.error(f"Unexpected error in main: {e}")
+        logger.error("Unexpected error in main: %s", e)
         print(f"An unexpected error occurred: {e}")
 
 
@@ -534,11 +1324,11 @@ if __name__ == "__main__":
     # image_path = r"D:\AI_coding\ig_song_suggestion\python_spotify\tests_static\mahak_udaiput.jpeg"
     # image_path = r"D:\AI_coding\ig_song_suggestion\python_spotify\tests_static\train_window.jpg"
     
-    main(
+    asyncio.run(main(
         image_path,
         language="hindi",
         genre="bollywood"
-    )
+    ))
 
 
 
@@ -1,22 +1,45 @@
-def main_prompt(language, genre_text, context=None, use_grounding=True):
-    """
-    Generates a concise prompt for the Gemini AI to suggest 3 songs based on an image.
+import hashlib
+import json
+import re
+import sys
+from string import Template
+from functools import lru_cache
 
-    Args:
-        language (str): The desired language for the song suggestion.
-        genre_text (str): A formatted string specifying the genre preference.
-        context (str, optional): User-provided context about the image.
-        use_grounding (bool): Whether Google Search grounding is available.
+# System instruction for the Google Search grounded call. Static, so every
+# request shares it as a leading prefix Gemini's implicit cache can reuse.
+GROUNDED_SYSTEM_INSTRUCTION = """You are an expert music curator for Instagram stories and reels.
 
-    Returns:
-        str: A concise, focused prompt for the AI.
-    """
-    context_text = f"\n\nUser context: {context}" if context else ""
-    
-    # Different prompts based on whether grounding is available
-    if use_grounding:
-        # Prompt for when Google Search grounding is available
-        song_sugg_prompt = f"""STEP 1 - ANALYZE THE IMAGE:
+YOUR WORKFLOW:
+1. ANALYZE THE IMAGE: Identify mood, setting, activity, colors, and aesthetic
+2. CRAFT SPECIFIC SEARCH QUERIES: Combine the visual analysis with language/genre to search for matching trending songs
+   - Include image-specific context in queries (e.g., "beach sunset vibes", "city night energy", "melancholic rainy day")
+   - Don't just search "trending hindi songs" - search "trending hindi romantic beach sunset songs october 2025"
+3. SELECT PERFECT MATCHES: Choose songs that match BOTH the trending status AND the specific image vibe for young users.
+
+CRITICAL:
+- Your Google Search queries MUST incorporate the visual analysis from the image
+- Match songs to the SPECIFIC emotional and visual mood of the image, not just general trends
+- Always provide real, existing songs with accurate titles and artist names
+- Return ONLY valid JSON with exactly 3 songs by different artists
+
+Example of GOOD search query formation:
+Image shows: Golden hour beach photo with couple
+Search: "trending hindi romantic beach golden hour songs instagram"
+
+Example of BAD search query:
+Image shows: Golden hour beach photo with couple
+Search: "trending hindi songs october 2025" ❌ (too generic, missing image context)"""
+
+# System instruction for the structured-output fallback (no grounding)
+FALLBACK_SYSTEM_INSTRUCTION = """You are an expert music curator for Instagram.
+Suggest songs that match the image's mood and vibe.
+Provide real, existing songs with accurate titles and artist names."""
+
+# Fixed parts of the per-request prompts, as string.Template so literal braces
+# (e.g. JSON examples) need no escaping. They contain no per-request data,
+# so every call shares the same leading bytes and the provider's prompt
+# cache can reuse them; language and context are appended at the very end.
+_GROUNDED_ANALYSIS = """STEP 1 - ANALYZE THE IMAGE:
 First, carefully examine this image and identify:
 - Primary mood/emotion (happy, melancholic, energetic, peaceful, romantic, etc.)
 - Visual setting (beach, city, nature, indoor, party, travel, etc.)
@@ -24,39 +47,261 @@ First, carefully examine this image and identify:
 - Lighting and colors (golden hour, neon lights, dark and moody, bright and vibrant, etc.)
 - Overall vibe/aesthetic (vintage, modern, minimalist, cinematic, candid, etc.)
 
-STEP 2 - USE GOOGLE SEARCH TO FIND MATCHING SONGS:
-Based on your image analysis, use Google Search to find trending {language} songs that match these specific visual characteristics.
+"""
+
+_GROUNDED_SEARCH = """STEP 2 - USE GOOGLE SEARCH TO FIND MATCHING SONGS:
+Based on your image analysis, use Google Search to find trending songs in the requested language (given at the end of this prompt) that match these specific visual characteristics.
 
 When searching, combine:
-1. The language: "{language}"
+1. The requested language
 2. The image's specific mood/vibe you identified (e.g., "romantic", "energetic", "melancholic")
 3. The setting/theme (e.g., "beach vibes", "city night", "road trip")
 4. Current trends: "october 2025 instagram tiktok trending"
 
-Example search queries you should generate:
-- "trending {language} romantic beach songs instagram"
-- "popular {language} energetic party anthems tiktok"
-- "viral {language} melancholic indie songs 2025"
+Example search query: "trending <language> <mood> <setting> songs instagram 2025"
+
+"""
 
-STEP 3 - PROVIDE RESULTS:
-Suggest 3 different songs by different artists that:
+_GROUNDED_RESULTS = """STEP 3 - PROVIDE RESULTS:
+Suggest $num_songs different songs by different artists that:
 - Match the SPECIFIC mood and setting you identified in the image
 - Are currently trending on Instagram/TikTok (based on your search)
-- Are in {language} language
+- Are in the requested language
 - Fit the appropriate genre based on the image's vibe
 
-Provide exact song titles and artist names.{context_text}"""
-    else:
-        # Prompt for fallback without grounding (rely on training data)
-        song_sugg_prompt = f"""Analyze this image and suggest 3 songs for an Instagram story that match its mood and vibe.{context_text}
+Provide exact song titles and artist names."""
+
+_GROUNDED_TEMPLATE = Template("".join((_GROUNDED_ANALYSIS, _GROUNDED_SEARCH, _GROUNDED_RESULTS)))
+
+_FALLBACK_TEMPLATE = Template("""Analyze this image and suggest $num_songs songs for an Instagram story that match its mood and vibe.
 
 Requirements:
-- All songs MUST be in {language} language
+- All songs MUST be in the requested language (given at the end of this prompt)
 - Match the genre to the image's mood and atmosphere
 - Suggest popular, well-known songs that fit the vibe
 - Provide exact song titles and artist names
 - Each song should be by a different artist
 
-Consider the image's colors, lighting, mood, setting, and emotional atmosphere when choosing songs."""
-    
-    return song_sugg_prompt
+Consider the image's colors, lighting, mood, setting, and emotional atmosphere when choosing songs.""")
+
+
+# Output format for grounded responses that are parsed locally. Grounded calls
+# can't use response_schema, so this is the only schema still sent as text.
+_SONGS_JSON_FORMAT_TEMPLATE = Template("""Respond with ONLY this JSON ($num_songs entries), no other text:
+{"songs": [{"Song_title": "<exact title>", "Artist": "<artist name>"}, ...]}""")
+
+
+def prompt_prefix(use_grounding=True, num_songs=3):
+    """
+    Returns the static instruction part of the song suggestion prompt.
+
+    The prefix is identical for every request with the same arguments, so it
+    is sent first and Gemini can reuse it through implicit caching. The
+    grounded prefix ends with the JSON format instruction, since grounded
+    output is parsed locally. It is memoized, so repeat calls return the
+    same string object.
+
+    Args:
+        use_grounding (bool): Whether Google Search grounding is available.
+        num_songs (int): How many songs to ask for (default: 3).
+
+    Returns:
+        str: The request-independent instructions.
+    """
+    # Normalize arguments so keyword and positional calls share one cache entry
+    return _render_prefix(bool(use_grounding), int(num_songs))
+
+
+@lru_cache(maxsize=32)
+def _render_prefix(use_grounding, num_songs):
+    if use_grounding:
+        return (_GROUNDED_TEMPLATE.substitute(num_songs=num_songs) + "\n\n"
+                + _SONGS_JSON_FORMAT_TEMPLATE.substitute(num_songs=num_songs))
+    return _FALLBACK_TEMPLATE.substitute(num_songs=num_songs)
+
+
+# User context is free-form text; keep it to one short line in the prompt
+MAX_CONTEXT_CHARS = 400
+_CONTROL_CHARS_RE = re.compile(r"[\x00-\x08\x0e-\x1f\x7f]")  # Non-whitespace control characters
+_WS_RE = re.compile(r"\s+")
+
+
+def _clean_context(ctx, max_chars=MAX_CONTEXT_CHARS):
+    """
+    Sanitizes user context before it is added to a prompt.
+
+    Drops control characters, collapses whitespace (including newlines) and
+    caps the length, so the dynamic suffix stays small and can't break the
+    prompt's structure.
+
+    Args:
+        ctx (str, optional): User-provided context about the image.
+        max_chars (int): Maximum length of the cleaned context.
+
+    Returns:
+        str: Cleaned context ("" if nothing is left).
+    """
+    if not ctx:
+        return ""
+    return _WS_RE.sub(" ", _CONTROL_CHARS_RE.sub("", ctx)).strip()[:max_chars].rstrip()
+
+
+def normalize_language(language):
+    """
+    Canonicalizes a language name so case/whitespace variants share caches.
+
+    "english", " English" and "ENGLISH" all become the same interned "English".
+
+    Args:
+        language (str): Language name as given by the caller.
+
+    Returns:
+        str: Title-cased, whitespace-collapsed, interned name ("English" if empty).
+    """
+    return sys.intern(" ".join((language or "").split()).title() or "English")
+
+
+def prompt_suffix(language, genre_text, context=None):
+    """
+    Returns the per-request part of the song suggestion prompt.
+
+    Args:
+        language (str): The desired language for the song suggestion.
+        genre_text (str): A formatted string specifying the genre preference.
+        context (str, optional): User-provided context about the image.
+
+    Returns:
+        str: Short block with the request's language, genre and context.
+    """
+    parts = [f"\n\nLanguage: {normalize_language(language)}"]
+    genre_text = (genre_text or "").strip()
+    if genre_text:
+        parts.append(f"Genre: {genre_text}")
+    context = _clean_context(context)
+    if context:
+        parts.append(f"User context: {context}")
+    return "\n".join(parts)
+
+
+def main_prompt(language, genre_text, context=None, use_grounding=True, num_songs=3):
+    """
+    Generates a concise prompt for the Gemini AI to suggest songs based on an image.
+
+    Static instructions come first and the request-specific values last, so
+    repeated calls share a cacheable prefix.
+
+    Args:
+        language (str): The desired language for the song suggestion.
+        genre_text (str): A formatted string specifying the genre preference.
+        context (str, optional): User-provided context about the image.
+        use_grounding (bool): Whether Google Search grounding is available.
+        num_songs (int): How many songs to ask for (default: 3).
+
+    Returns:
+        str: A concise, focused prompt for the AI.
+    """
+    build = main_prompt_grounded if use_grounding else main_prompt_ungrounded
+    return build(language, genre_text, context, num_songs)
+
+
+def main_prompt_grounded(language, genre_text, context=None, num_songs=3):
+    """
+    Generates the Google Search grounded prompt (main_prompt with use_grounding=True).
+
+    Args:
+        language (str): The desired language for the song suggestion.
+        genre_text (str): A formatted string specifying the genre preference.
+        context (str, optional): User-provided context about the image.
+        num_songs (int): How many songs to ask for (default: 3).
+
+    Returns:
+        str: The grounded prompt.
+    """
+    return _render_prefix(True, int(num_songs)) + prompt_suffix(language, genre_text, context)
+
+
+def main_prompt_ungrounded(language, genre_text, context=None, num_songs=3):
+    """
+    Generates the fallback prompt without grounding (main_prompt with use_grounding=False).
+
+    Args:
+        language (str): The desired language for the song suggestion.
+        genre_text (str): A formatted string specifying the genre preference.
+        context (str, optional): User-provided context about the image.
+        num_songs (int): How many songs to ask for (default: 3).
+
+    Returns:
+        str: The fallback prompt.
+    """
+    return _render_prefix(False, int(num_songs)) + prompt_suffix(language, genre_text, context)
+
+
+_BATCHED_TEMPLATE = Template("""You are given several images, labelled Image 1, Image 2, and so on. For EACH image separately, suggest $num_songs songs for an Instagram story that match its mood and vibe.
+
+Requirements:
+- All songs MUST be in the requested language (given at the end of this prompt)
+- Match the genre to each image's mood and atmosphere
+- Suggest popular, well-known songs that fit the vibe
+- Provide exact song titles and artist names
+- Each image's $num_songs songs should be by different artists
+- Return exactly one result per image, with image_index set to the number in the image's label
+
+Consider each image's colors, lighting, mood, setting, and emotional atmosphere when choosing songs.""")
+
+
+@lru_cache(maxsize=32)
+def _render_batched_prefix(num_songs):
+    return _BATCHED_TEMPLATE.substitute(num_songs=num_songs)
+
+
+def prompt_cache_key(language, genre_text, context, use_grounding, image_sha256):
+    """
+    Returns a stable key for caching the model's answer to one prompt + image.
+
+    Two requests get the same key only if they would send the same prompt
+    and the same image bytes, so the stored response can be reused as is.
+
+    Args:
+        language (str): The desired language for the song suggestion.
+        genre_text (str): A formatted string specifying the genre preference.
+        context (str, optional): User-provided context about the image.
+        use_grounding (bool): Whether Google Search grounding is used.
+        image_sha256 (str): Hex SHA-256 digest of the image bytes.
+
+    Returns:
+        str: 32-character hex digest.
+    """
+    # JSON keeps field boundaries unambiguous even if context contains separators
+    raw = json.dumps([normalize_language(language), (genre_text or "").strip(), _clean_context(context), bool(use_grounding), image_sha256])
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def batched_main_prompt(language, genre_text, items, num_songs=3):
+    """
+    Generates a prompt asking Gemini to suggest songs for each of several images.
+
+    The images are sent in the same request, each preceded by an "Image <id>:"
+    label. The static instructions come first and only the per-image block
+    varies between batches.
+
+    Args:
+        language (str): The desired language for the song suggestions.
+        genre_text (str): A formatted string specifying the genre preference.
+        items (list): One dict per image, in order, with an "id" (the number
+            in its label) and an optional user-provided "context".
+        num_songs (int): How many songs to ask for per image (default: 3).
+
+    Returns:
+        str: A prompt requesting one result of num_songs songs per image.
+    """
+    image_blocks = "\n".join(
+        f"### Image {item['id']} context: {_clean_context(item.get('context')) or '(none)'}"
+        for item in items
+    )
+
+    return f"""{_render_batched_prefix(int(num_songs))}
+
+Number of images: {len(items)}
+Language: {normalize_language(language)}
+
+{image_blocks}"""
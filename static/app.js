@@ -20,6 +20,7 @@ let selectedFile = null;
 let uploadedImageDataUrl = null;
 let loadingMessageInterval = null;
 let spotifyPlayers = []; // Array to track all Spotify iframe players
+let scrollObserver = null; // Pauses players on cards scrolled out of view
 
 // API Base URL - dynamically configured
 // For Vercel deployment, you need to set this in Vercel dashboard as environment variable
@@ -215,8 +216,8 @@ async function handleSubmit() {
             formData.append('context', context);
         }
         
-        // Make API request
-        const response = await fetch(`${API_BASE_URL}/suggest-song`, {
+        // Make API request - songs stream back as NDJSON, one per line
+        const response = await fetch(`${API_BASE_URL}/suggest-song/stream`, {
             method: 'POST',
             body: formData
         });
@@ -226,14 +227,26 @@ async function handleSubmit() {
             throw new Error(errorData.detail || 'failed to get song suggestion');
         }
         
-        const data = await response.json();
-        
-        // Stop loading message rotation
-        stopLoadingMessages();
+        const songs = [];
+        await readSongStream(response, (song) => {
+            if (song.error) {
+                throw new Error(song.error);
+            }
+            songs.push(song);
+            
+            if (songs.length === 1) {
+                // Show results as soon as the first song arrives
+                stopLoadingMessages();
+                loading.classList.add('hidden');
+                displayResults({ songs });
+            } else {
+                appendSongCard(song, songs.length - 1);
+            }
+        });
         
-        // Hide loading and show results
-        loading.classList.add('hidden');
-        displayResults(data);
+        if (songs.length === 0) {
+            throw new Error('failed to get song suggestion');
+        }
         
     } catch (error) {
         console.error('Error:', error);
@@ -258,6 +271,28 @@ async function handleSubmit() {
     }
 }
 
+// Read an NDJSON response body, calling onSong for each parsed line
+async function readSongStream(response, onSong) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop(); // Keep any partial line for the next chunk
+        
+        lines.filter(line => line.trim()).forEach(line => onSong(JSON.parse(line)));
+    }
+    
+    if (buffer.trim()) {
+        onSong(JSON.parse(buffer));
+    }
+}
+
 // Loading Message Management
 function startLoadingMessages() {
     const loadingMessage = document.getElementById('loadingMessage');
@@ -347,6 +382,15 @@ function displayResults(data) {
     setupScrollObserver();
 }
 
+// Add a card for a song that streamed in after the first one
+function appendSongCard(song, index) {
+    const songCard = createSongCard(song, index);
+    document.getElementById('songsContainer').appendChild(songCard);
+    if (scrollObserver) {
+        scrollObserver.observe(songCard);
+    }
+}
+
 // Setup intersection observer to pause players when scrolling away
 function setupScrollObserver() {
     const options = {
@@ -354,6 +398,10 @@ function setupScrollObserver() {
         threshold: 0.5 // Trigger when 50% of the card is visible
     };
     
+    if (scrollObserver) {
+        scrollObserver.disconnect();
+    }
+    
     const observer = new IntersectionObserver((entries) => {
         entries.forEach(entry => {
             const songIndex = parseInt(entry.target.getAttribute('data-song-index'));
@@ -374,6 +422,8 @@ function setupScrollObserver() {
     document.querySelectorAll('.song-card').forEach(card => {
         observer.observe(card);
     });
+    
+    scrollObserver = observer;
 }
 
 // Create a song card element
@@ -0,0 +1,113 @@
+import io
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from google.genai import errors as genai_errors
+from PIL import Image
+
+# The app is a set of flat modules at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from main import Gemini  # noqa: E402
+
+SONGS_JSON = ('{"songs": [{"Song_title": "Song A", "Artist": "Artist A"}, '
+              '{"Song_title": "Song B", "Artist": "Artist B"}, '
+              '{"Song_title": "Song C", "Artist": "Artist C"}]}')
+
+
+def server_error(code: int = 503) -> genai_errors.ServerError:
+    """A Gemini 5xx error as the SDK raises it."""
+    return genai_errors.ServerError(code, {"error": {"code": code, "message": "unavailable", "status": "UNAVAILABLE"}})
+
+
+def client_error(code: int = 400) -> genai_errors.ClientError:
+    """A Gemini 4xx error as the SDK raises it."""
+    return genai_errors.ClientError(code, {"error": {"code": code, "message": "bad image", "status": "INVALID_ARGUMENT"}})
+
+
+def png_bytes(color=(200, 120, 40), size=(64, 64)) -> bytes:
+    """Encode a small solid-color image with a gradient, so it has a stable pHash."""
+    img = Image.new("RGB", size, color)
+    for x in range(size[0]):
+        img.putpixel((x, x % size[1]), (x * 4 % 256, 255 - x * 4 % 256, 0))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeModels:
+    """Stands in for client.models / client.aio.models.
+
+    `responses` is consumed in order by generate_content: a str becomes the
+    response text, an exception is raised. `stream_chunks` feeds
+    generate_content_stream.
+    """
+
+    def __init__(self, responses=(), stream_chunks=()):
+        self.responses = list(responses)
+        self.stream_chunks = list(stream_chunks)
+        self.calls = []
+
+    def generate_content(self, model, contents, config=None):
+        self.calls.append(SimpleNamespace(model=model, contents=contents, config=config))
+        if not self.responses:
+            raise AssertionError("unexpected generate_content call")
+        result = self.responses.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return SimpleNamespace(text=result, candidates=[])
+
+    async def generate_content_stream(self, model, contents, config=None):
+        self.calls.append(SimpleNamespace(model=model, contents=contents, config=config))
+        chunks = self.stream_chunks
+
+        async def stream():
+            for chunk in chunks:
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield SimpleNamespace(text=chunk)
+
+        return stream()
+
+
+class FakeFiles:
+    """Stands in for client.files, recording uploads."""
+
+    def __init__(self):
+        self.uploads = []
+
+    def upload(self, file, config=None):
+        data = file.read()
+        self.uploads.append(data)
+        return SimpleNamespace(uri=f"https://files.example/{len(self.uploads)}", mime_type=config.mime_type)
+
+
+class FakeGenaiClient:
+    """Minimal google-genai client: models, aio.models and files."""
+
+    def __init__(self, responses=(), stream_chunks=()):
+        self.models = FakeModels(responses, stream_chunks)
+        self.aio = SimpleNamespace(models=self.models)
+        self.files = FakeFiles()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """Retry immediately instead of sleeping through backoff delays."""
+    monkeypatch.setattr(main, "_backoff_delay", lambda *args, **kwargs: 0.0)
+
+
+@pytest.fixture
+def make_gemini(monkeypatch, tmp_path):
+    """Build a Gemini instance backed by a FakeGenaiClient."""
+    monkeypatch.setattr(Gemini, "RESULT_CACHE_DIR", str(tmp_path / "suggestions"))
+
+    def factory(responses=(), stream_chunks=()):
+        gemini = Gemini(api_key="test-key")
+        gemini.client = FakeGenaiClient(responses, stream_chunks)
+        return gemini
+
+    return factory
@@ -0,0 +1,116 @@
+import orjson
+import pytest
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+
+import api
+from cache import GeminiCache
+from main import CircuitOpenError
+from conftest import SONGS_JSON, png_bytes
+
+
+class FakeGemini:
+    """Serves canned songs to the API, or fails fast like an open breaker."""
+
+    def __init__(self, songs=None, circuit_open=False):
+        self.songs = songs if songs is not None else orjson.loads(SONGS_JSON)["songs"]
+        self.circuit_open = circuit_open
+        self.calls = 0
+
+    def check_available(self):
+        if self.circuit_open:
+            raise CircuitOpenError(12.3)
+
+    def song_title_gen_bytes(self, image_bytes, mime_type, language="English", genre=None, context=None):
+        self.check_available()
+        self.calls += 1
+        return orjson.dumps({"songs": self.songs}).decode()
+
+    async def song_title_stream(self, image_bytes, mime_type, language="English", genre=None, context=None):
+        self.check_available()
+        self.calls += 1
+        for song in self.songs:
+            yield song
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """TestClient with a fresh cache, no Spotify and a swappable fake Gemini.
+
+    Not entered as a context manager, so the lifespan (which talks to the
+    real APIs) doesn't run.
+    """
+    fake = {"gemini": FakeGemini()}
+    monkeypatch.setattr(api, "gemini_cache", GeminiCache())
+    monkeypatch.setattr(api, "batch_scheduler", None)
+    monkeypatch.setattr(api, "get_gemini", lambda: fake["gemini"])
+    monkeypatch.setattr(api, "get_spotify_or_none", lambda: None)
+    test_client = TestClient(api.app)
+    test_client.fake = fake
+    return test_client
+
+
+def upload(client, path, image=None):
+    files = {"image": ("photo.png", image or png_bytes(), "image/png")}
+    return client.post(path, files=files, data={"language": "english"})
+
+
+def stream_lines(response):
+    return [orjson.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_single_suggest_song_route():
+    routes = [route for route in api.app.routes if isinstance(route, APIRoute) and route.path == "/suggest-song"]
+    assert len(routes) == 1
+    assert routes[0].methods == {"POST"}
+
+
+def test_suggest_song_returns_three_songs(client):
+    response = upload(client, "/suggest-song")
+
+    assert response.status_code == 200
+    songs = response.json()["songs"]
+    assert [song["song_title"] for song in songs] == ["Song A", "Song B", "Song C"]
+    assert all(song["spotify_error"] for song in songs)  # Spotify is unavailable in tests
+
+
+def test_repeat_upload_is_served_from_cache(client):
+    image = png_bytes()
+    upload(client, "/suggest-song", image)
+    upload(client, "/suggest-song", image)
+    assert client.fake["gemini"].calls == 1
+
+
+def test_rejects_unsupported_type(client):
+    response = client.post("/suggest-song", files={"image": ("notes.txt", b"hi", "text/plain")})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/suggest-song", "/suggest-song/stream"])
+def test_open_circuit_returns_503_with_retry_after(client, path):
+    client.fake["gemini"] = FakeGemini(circuit_open=True)
+    response = upload(client, path)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "13"
+
+
+def test_stream_emits_one_line_per_song(client):
+    response = upload(client, "/suggest-song/stream")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [song["song_title"] for song in stream_lines(response)] == ["Song A", "Song B", "Song C"]
+
+
+@pytest.mark.parametrize("path", ["/suggest-song", "/suggest-song/stream"])
+def test_songs_without_title_or_artist_are_dropped(client, path):
+    client.fake["gemini"] = FakeGemini(songs=[
+        {"Song_title": "Song A", "Artist": "Artist A"},
+        {"Song_title": "", "Artist": "Artist B"},
+        {"Song_title": "Song C", "Artist": ""},
+    ])
+    response = upload(client, path)
+
+    songs = response.json()["songs"] if path == "/suggest-song" else stream_lines(response)
+    assert [song["song_title"] for song in songs] == ["Song A"]
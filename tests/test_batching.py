@@ -0,0 +1,114 @@
+import asyncio
+
+import orjson
+import pytest
+
+from batching import BatchScheduler
+from main import Gemini, InvalidModelOutputError
+from conftest import SONGS_JSON, png_bytes
+
+
+class FakeGemini:
+    """Records batched and single calls; results are keyed by image bytes."""
+
+    def __init__(self, batch_results=None, batch_error=None):
+        self.batch_results = batch_results or {}
+        self.batch_error = batch_error
+        self.batch_calls = []
+        self.single_calls = []
+
+    def song_title_gen_batch(self, images, language="English", genre=None, contexts=None):
+        self.batch_calls.append(([image for image, _ in images], language, genre, contexts))
+        if self.batch_error:
+            raise self.batch_error
+        return [self.batch_results.get(image, SONGS_JSON) for image, _ in images]
+
+    def song_title_gen_bytes(self, image_bytes, mime_type, language="English", genre=None, context=None):
+        self.single_calls.append(image_bytes)
+        return f"single:{image_bytes.decode()}"
+
+
+def run_batch(gemini, requests, max_batch_size=4):
+    """Submit requests concurrently through a scheduler and return their results."""
+
+    async def scenario():
+        scheduler = BatchScheduler(lambda: gemini, max_batch_size=max_batch_size, max_wait=0.05)
+        scheduler.start()
+        try:
+            return await asyncio.gather(*(
+                scheduler.submit(image, "image/png", language=language, genre=genre)
+                for image, language, genre in requests
+            ))
+        finally:
+            await scheduler.stop()
+
+    return asyncio.run(scenario())
+
+
+def test_concurrent_requests_share_one_call():
+    gemini = FakeGemini()
+    results = run_batch(gemini, [(b"a", "English", None), (b"b", "English", None), (b"c", "English", None)])
+
+    assert results == [SONGS_JSON] * 3
+    assert [call[0] for call in gemini.batch_calls] == [[b"a", b"b", b"c"]]
+    assert gemini.single_calls == []
+
+
+def test_requests_are_grouped_by_language_and_genre():
+    gemini = FakeGemini()
+    run_batch(gemini, [
+        (b"a", "English", None), (b"b", "Hindi", None),
+        (b"c", "English", None), (b"d", "Hindi", None),
+    ])
+
+    batches = sorted((call[1], call[0]) for call in gemini.batch_calls)
+    assert batches == [("English", [b"a", b"c"]), ("Hindi", [b"b", b"d"])]
+
+
+def test_lone_request_uses_the_single_image_pipeline():
+    gemini = FakeGemini()
+    assert run_batch(gemini, [(b"a", "English", None)]) == ["single:a"]
+    assert gemini.batch_calls == []
+
+
+def test_missing_batch_results_are_retried_individually():
+    gemini = FakeGemini(batch_results={b"b": None})
+    results = run_batch(gemini, [(b"a", "English", None), (b"b", "English", None)])
+
+    assert results == [SONGS_JSON, "single:b"]
+    assert gemini.single_calls == [b"b"]
+
+
+def test_failed_batch_falls_back_to_single_calls():
+    gemini = FakeGemini(batch_error=RuntimeError("boom"))
+    results = run_batch(gemini, [(b"a", "English", None), (b"b", "English", None)])
+
+    assert results == ["single:a", "single:b"]
+
+
+def batch_response(count):
+    songs = orjson.loads(SONGS_JSON)["songs"]
+    return orjson.dumps({"results": [{"image_index": i + 1, "songs": songs} for i in range(count)]}).decode()
+
+
+def test_batch_uploads_images_past_the_inline_budget(make_gemini, monkeypatch):
+    monkeypatch.setattr(Gemini, "LARGE_IMAGE_BYTES", 100)
+    monkeypatch.setattr(Gemini, "INLINE_REQUEST_BYTES", 150)
+    gemini = make_gemini(responses=[batch_response(3)])
+    images = [(b"x" * 80, "image/png"), (b"y" * 80, "image/png"), (b"z" * 200, "image/png")]
+
+    results = gemini.song_title_gen_batch(images)
+
+    assert [orjson.loads(result) for result in results] == [orjson.loads(SONGS_JSON)] * 3
+    # First image fits inline; the second overflows the budget, the third is large
+    assert gemini.client.files.uploads == [b"y" * 80, b"z" * 200]
+    parts = gemini.client.models.calls[0].contents[1::2][:3]
+    assert parts[0].inline_data is not None
+    assert parts[1].file_data is not None and parts[2].file_data is not None
+
+
+def test_invalid_batch_output_counts_as_a_provider_failure(make_gemini):
+    gemini = make_gemini(responses=['{"results": [{"image_index": 1, "songs": []}]}'])
+    with pytest.raises(InvalidModelOutputError):
+        gemini.song_title_gen_batch([(png_bytes(), "image/png"), (png_bytes(), "image/png")])
+    assert gemini._circuit_failures == 1
@@ -0,0 +1,54 @@
+import io
+
+from PIL import Image
+
+from cache import GeminiCache
+from conftest import SONGS_JSON, png_bytes
+
+
+def reencoded_as_jpeg(image_bytes):
+    """Same picture, different bytes (what a re-upload from another app looks like)."""
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(image_bytes)).convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def test_near_duplicate_image_hits():
+    cache = GeminiCache()
+    original = png_bytes()
+    cache.set(GeminiCache.image_hash(original), "English", None, None, SONGS_JSON)
+
+    assert cache.get(GeminiCache.image_hash(reencoded_as_jpeg(original)), "English", None, None) == SONGS_JSON
+
+
+def test_different_image_or_options_miss():
+    cache = GeminiCache()
+    image_hash = GeminiCache.image_hash(png_bytes())
+    cache.set(image_hash, "English", None, "beach day", SONGS_JSON)
+
+    assert cache.get(image_hash ^ 0xFFFF, "English", None, "beach day") is None
+    assert cache.get(image_hash, "Hindi", None, "beach day") is None
+    assert cache.get(image_hash, "English", None, "city night") is None
+
+
+def test_context_matcher_can_match_paraphrased_context():
+    class SameContext:
+        def same(self, a, b):
+            return True
+
+    cache = GeminiCache(context_matcher=SameContext())
+    image_hash = GeminiCache.image_hash(png_bytes())
+    cache.set(image_hash, "English", None, "golden hour beach", SONGS_JSON)
+
+    assert cache.get(image_hash, "English", None, "beach at sunset") == SONGS_JSON
+
+
+def test_undecodable_image_has_no_hash():
+    assert GeminiCache.image_hash(b"not an image") is None
+
+
+def test_exact_entries():
+    cache = GeminiCache()
+    cache.set_exact("key", SONGS_JSON)
+    assert cache.get_exact("key") == SONGS_JSON
+    assert cache.get_exact("other") is None
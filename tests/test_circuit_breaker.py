@@ -0,0 +1,144 @@
+import asyncio
+
+import httpx
+import pytest
+
+from main import CircuitOpenError, Gemini, InvalidModelOutputError, _is_provider_failure
+from conftest import SONGS_JSON, client_error, png_bytes, server_error
+
+
+def trip(gemini):
+    """Record enough provider failures to open the breaker."""
+    for _ in range(Gemini.CIRCUIT_FAILURE_THRESHOLD):
+        gemini._record_failure(server_error())
+
+
+@pytest.mark.parametrize("error, expected", [
+    (server_error(503), True),
+    (server_error(500), True),
+    (client_error(429), True),
+    (client_error(400), False),
+    (httpx.ConnectError("refused"), True),
+    (TimeoutError(), True),
+    (InvalidModelOutputError("empty"), True),
+    (ValueError("bad input"), False),
+    (IOError("Image data is empty"), False),
+])
+def test_is_provider_failure(error, expected):
+    assert _is_provider_failure(error) is expected
+
+
+def test_is_provider_failure_follows_the_cause_chain():
+    try:
+        try:
+            raise client_error(400)
+        except Exception as e:
+            raise Exception("Failed to generate song suggestions after all attempts") from e
+    except Exception as wrapped:
+        assert _is_provider_failure(wrapped) is False
+
+
+def test_provider_failures_open_the_breaker(make_gemini):
+    # Every rung of the generation ladder hits a 5xx, after all retries
+    gemini = make_gemini(responses=[server_error()] * 1000)
+    image = png_bytes()
+
+    for _ in range(Gemini.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(Exception):
+            gemini.song_title_gen_bytes(image, "image/png")
+
+    calls = len(gemini.client.models.calls)
+    with pytest.raises(CircuitOpenError) as exc_info:
+        gemini.song_title_gen_bytes(image, "image/png")
+    assert exc_info.value.retry_after > 0
+    assert len(gemini.client.models.calls) == calls  # Failed fast without calling Gemini
+
+
+def test_client_errors_do_not_open_the_breaker(make_gemini):
+    gemini = make_gemini(responses=[client_error(400)] * 100)
+
+    for _ in range(Gemini.CIRCUIT_FAILURE_THRESHOLD * 2):
+        with pytest.raises(Exception):
+            gemini.song_title_gen_bytes(png_bytes(), "image/png")
+
+    assert gemini._circuit_failures == 0
+    gemini.check_available()
+
+
+def test_input_errors_do_not_reach_the_breaker(make_gemini):
+    gemini = make_gemini()
+    for _ in range(Gemini.CIRCUIT_FAILURE_THRESHOLD * 2):
+        with pytest.raises(IOError):
+            gemini.song_title_gen_bytes(b"", "image/png")
+    assert gemini._circuit_failures == 0
+
+
+def test_half_open_lets_a_single_trial_through(make_gemini):
+    gemini = make_gemini()
+    trip(gemini)
+    with pytest.raises(CircuitOpenError):
+        gemini._check_circuit()
+
+    gemini._circuit_open_until = 0  # Window is over
+    gemini.check_available()  # Probing doesn't claim the trial
+    assert gemini._check_circuit() is True
+
+    # Everyone else keeps failing fast while the trial is in flight
+    with pytest.raises(CircuitOpenError):
+        gemini._check_circuit()
+    with pytest.raises(CircuitOpenError):
+        gemini.check_available()
+
+    gemini._record_success(is_trial=True)
+    assert gemini._check_circuit() is False
+    assert gemini._circuit_failures == 0
+
+
+def test_failed_trial_reopens_the_breaker(make_gemini):
+    gemini = make_gemini()
+    trip(gemini)
+    gemini._circuit_open_until = 0
+
+    assert gemini._check_circuit() is True
+    gemini._record_failure(server_error(), is_trial=True)
+
+    with pytest.raises(CircuitOpenError) as exc_info:
+        gemini._check_circuit()
+    assert exc_info.value.retry_after > 1
+
+
+def test_trial_with_client_error_frees_the_slot(make_gemini):
+    gemini = make_gemini()
+    trip(gemini)
+    gemini._circuit_open_until = 0
+
+    assert gemini._check_circuit() is True
+    gemini._record_failure(client_error(400), is_trial=True)
+
+    # Still half-open: the next caller becomes the trial
+    assert gemini._check_circuit() is True
+
+
+def test_successful_trial_call_closes_the_breaker(make_gemini):
+    gemini = make_gemini(responses=[SONGS_JSON])
+    trip(gemini)
+    gemini._circuit_open_until = 0
+
+    assert gemini.song_title_gen_bytes(png_bytes(), "image/png")
+    assert gemini._circuit_failures == 0
+    assert gemini._check_circuit() is False
+
+
+def test_abandoned_stream_releases_the_trial(make_gemini):
+    gemini = make_gemini(stream_chunks=[SONGS_JSON])
+    trip(gemini)
+    gemini._circuit_open_until = 0
+
+    async def take_first_song():
+        stream = gemini.song_title_stream(png_bytes(), "image/png")
+        song = await stream.__anext__()
+        await stream.aclose()  # Client disconnected
+        return song
+
+    assert asyncio.run(take_first_song())["Song_title"] == "Song A"
+    assert gemini._circuit_trial_in_flight is False
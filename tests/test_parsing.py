@@ -0,0 +1,54 @@
+import orjson
+
+from main import Gemini
+from conftest import SONGS_JSON
+
+
+def titles(song_json):
+    return [song["Song_title"] for song in orjson.loads(song_json)["songs"]]
+
+
+def test_parse_grounded_json_accepts_plain_json():
+    assert titles(Gemini._parse_grounded_json(SONGS_JSON)) == ["Song A", "Song B", "Song C"]
+
+
+def test_parse_grounded_json_finds_json_in_code_fence():
+    text = f"Here are your songs:\n```json\n{SONGS_JSON}\n```\nEnjoy!"
+    assert titles(Gemini._parse_grounded_json(text)) == ["Song A", "Song B", "Song C"]
+
+
+def test_parse_grounded_json_falls_back_to_song_objects_in_prose():
+    text = ('1. {"Song_title": "One", "Artist": "X"} and then '
+            '{"Song_title": "Two", "Artist": "Y"}, finally {"Song_title": "Three", "Artist": "Z"}')
+    assert titles(Gemini._parse_grounded_json(text)) == ["One", "Two", "Three"]
+
+
+def test_parse_grounded_json_keeps_the_first_three_songs():
+    songs = [{"Song_title": f"Song {i}", "Artist": f"Artist {i}"} for i in range(5)]
+    text = orjson.dumps({"songs": songs}).decode()
+    assert titles(Gemini._parse_grounded_json(text)) == ["Song 0", "Song 1", "Song 2"]
+
+
+def test_parse_grounded_json_rejects_too_few_songs():
+    text = '{"songs": [{"Song_title": "Only", "Artist": "One"}]}'
+    assert Gemini._parse_grounded_json(text) is None
+    assert Gemini._parse_grounded_json("no songs here") is None
+
+
+def test_validate_songs_json_rejects_blank_fields():
+    text = SONGS_JSON.replace('"Artist B"', '""')
+    assert Gemini._validate_songs_json(text) is None
+
+
+def test_extract_songs_handles_partial_stream_output():
+    partial = SONGS_JSON[:SONGS_JSON.index('"Song C"')]
+    assert Gemini._extract_songs(partial) == [
+        {"Song_title": "Song A", "Artist": "Artist A"},
+        {"Song_title": "Song B", "Artist": "Artist B"},
+    ]
+
+
+def test_extract_songs_unescapes_and_skips_blank_songs():
+    text = ('{"Song_title": "Say \\"Hi\\"", "Artist": "A"} '
+            '{"Song_title": "  ", "Artist": "B"} {"Song_title": "C", "Artist": ""}')
+    assert Gemini._extract_songs(text) == [{"Song_title": 'Say "Hi"', "Artist": "A"}]
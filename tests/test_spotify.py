@@ -0,0 +1,156 @@
+import asyncio
+import time
+
+import httpx
+import orjson
+import pytest
+
+import main
+from main import Spotify
+
+
+def track(name="Song A", artist="Someone Else", track_id="t1"):
+    return {
+        "id": track_id,
+        "name": name,
+        "artists": [{"name": artist}],
+        "preview_url": None,
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+    }
+
+
+def search_response(*items):
+    return httpx.Response(200, content=orjson.dumps({"tracks": {"items": list(items)}}))
+
+
+def token_response(token):
+    return httpx.Response(200, content=orjson.dumps({"access_token": token, "expires_in": 3600}))
+
+
+@pytest.fixture
+def make_spotify(monkeypatch, tmp_path):
+    """Build a Spotify client whose requests go to a MockTransport handler."""
+    monkeypatch.setattr(Spotify, "TOKEN_CACHE_DIR", str(tmp_path))
+
+    def factory(handler):
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return Spotify("client-id", "client-secret", http_client=http_client)
+
+    return factory
+
+
+def test_token_is_fetched_once_for_concurrent_searches(make_spotify):
+    token_requests = []
+
+    def handler(request):
+        if request.url.host == "accounts.spotify.com":
+            token_requests.append(request)
+            return token_response("token-1")
+        assert request.headers["Authorization"] == "Bearer token-1"
+        return search_response(track())
+
+    spotify = make_spotify(handler)
+
+    async def search_all():
+        return await asyncio.gather(*(spotify.search_track(f"Song {i}") for i in range(5)))
+
+    assert all(asyncio.run(search_all()))
+    assert len(token_requests) == 1
+
+
+def test_revoked_token_is_refreshed_and_the_search_retried(make_spotify):
+    tokens = iter(["stale", "fresh"])
+
+    def handler(request):
+        if request.url.host == "accounts.spotify.com":
+            return token_response(next(tokens))
+        if request.headers["Authorization"] == "Bearer stale":
+            return httpx.Response(401)
+        return search_response(track())
+
+    spotify = make_spotify(handler)
+    result = asyncio.run(spotify.search_track("Song A"))
+
+    assert result["id"] == "t1"
+    assert spotify.token == "fresh"
+
+
+def test_token_is_cached_on_disk(make_spotify):
+    spotify = make_spotify(lambda request: token_response("cached-token"))
+    asyncio.run(spotify._ensure_valid_token())
+
+    reloaded = make_spotify(lambda request: pytest.fail("token should come from the disk cache"))
+    assert reloaded.token == "cached-token"
+    assert reloaded._is_token_valid()
+
+
+def test_retry_after_longer_than_the_cap_gives_up(make_spotify):
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        return httpx.Response(429, headers={"Retry-After": "3600"})
+
+    spotify = make_spotify(handler)
+    response = asyncio.run(spotify._request("GET", Spotify.SEARCH_URL))
+
+    assert response.status_code == 429
+    assert len(attempts) == 1
+
+
+def test_negative_retry_after_is_clamped(make_spotify, monkeypatch):
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def record_sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(main.asyncio, "sleep", record_sleep)
+    responses = iter([httpx.Response(503, headers={"Retry-After": "-5"}), httpx.Response(200)])
+    spotify = make_spotify(lambda request: next(responses))
+
+    assert asyncio.run(spotify._request("GET", Spotify.SEARCH_URL)).status_code == 200
+    assert delays == [0.0]
+
+
+def test_throttle_spreads_requests_over_the_rate_window(make_spotify, monkeypatch):
+    monkeypatch.setattr(Spotify, "RATE_LIMIT", 2)
+    monkeypatch.setattr(Spotify, "RATE_WINDOW", 0.2)
+    spotify = make_spotify(lambda request: httpx.Response(200))
+
+    async def burst():
+        start = time.monotonic()
+        await asyncio.gather(*(spotify._request("GET", Spotify.SEARCH_URL) for _ in range(4)))
+        return time.monotonic() - start
+
+    # Requests 3 and 4 have to wait for the first two to leave the window
+    assert asyncio.run(burst()) >= 0.2
+
+
+def test_caller_artist_is_kept_only_for_the_artist_query(make_spotify):
+    def handler(request):
+        if request.url.host == "accounts.spotify.com":
+            return token_response("token")
+        query = request.url.params["q"]
+        if "artist:" in query:
+            return search_response()  # Strategy 1 misses
+        return search_response(track(artist="Spotify Artist"))
+
+    spotify = make_spotify(handler)
+    result = asyncio.run(spotify.search_track("Song A", "Requested Artist"))
+
+    # Found by the free-text strategy, so the artist comes from Spotify's result
+    assert result["artist"] == "Spotify Artist"
+
+
+def test_artist_query_hit_keeps_the_caller_artist(make_spotify):
+    def handler(request):
+        if request.url.host == "accounts.spotify.com":
+            return token_response("token")
+        return search_response(track(artist="Requested Artist feat. Someone"))
+
+    spotify = make_spotify(handler)
+    result = asyncio.run(spotify.search_track("Song A", "Requested Artist"))
+
+    assert result["artist"] == "Requested Artist"